@@ -0,0 +1,94 @@
+"""
+Compiled answer keys for grading live answers.
+
+A quiz's content is reduced once to a tuple of (question_type, correct_mask)
+pairs, where bit i of the mask is set when choice i is correct, so grading an
+answer is a bitmask comparison instead of re-normalising the whole quiz.
+Submitted indexes are range-checked against the question's choice count
+before they are shifted, so a client cannot make grading build huge ints.
+
+Keys are cached in-process per quiz and tagged with Quiz.content_version.
+Saving new content bumps the version, so the next lookup recompiles.
+"""
+from __future__ import annotations
+
+import threading
+
+POINTS_PER_QUESTION = 10
+MAX_KEYS = 1024  # compiled quizzes kept per process
+MAX_SELECTED = 32  # longest accepted selection; longer ones grade as empty
+
+_lock = threading.Lock()
+_keys: dict[int, "AnswerKey"] = {}
+
+
+class AnswerKey:
+    """Immutable per-question (type, correct-choice bitmask) table for one quiz version."""
+
+    __slots__ = ("quiz_id", "version", "_types", "_masks", "_counts")
+
+    def __init__(self, quiz_id: int, version: int, content):
+        types, masks, counts = [], [], []
+        for d in content or []:
+            types.append((d.get("question_type") or d.get("QuestionType") or "MCQ").upper() == "MSQ")
+            choices = d.get("choices") or d.get("Choices") or []
+            mask = 0
+            for i, ch in enumerate(choices):
+                if ch.get("is_correct"):
+                    mask |= 1 << i
+            masks.append(mask)
+            counts.append(len(choices))
+        self.quiz_id = quiz_id
+        self.version = version
+        self._types = tuple(types)   # True for MSQ (all correct choices), False for single-answer
+        self._masks = tuple(masks)
+        self._counts = tuple(counts)  # choices per question; indexes at or past it score 0
+
+    def __len__(self):
+        return len(self._masks)
+
+    def grade(self, idx: int, selected) -> int:
+        """Points for a list of selected choice indexes on question idx."""
+        if not (0 <= idx < len(self._masks)) or len(selected) > MAX_SELECTED:
+            return 0
+        n = self._counts[idx]
+        sel = 0
+        for i in selected:
+            if not 0 <= i < n:
+                return 0  # not a choice of this question (and never shifted)
+            sel |= 1 << i
+        correct = self._masks[idx]
+        if self._types[idx]:
+            return POINTS_PER_QUESTION if sel == correct else 0
+        # single answer: exactly one bit set, and it is a correct one
+        if not sel or sel & (sel - 1):
+            return 0
+        return POINTS_PER_QUESTION if sel & correct else 0
+
+
+def parse_selected(raw) -> list[int]:
+    """Client-sent choice indexes as ints; [] if malformed or longer than MAX_SELECTED."""
+    if not isinstance(raw, (list, tuple)) or len(raw) > MAX_SELECTED:
+        return []
+    try:
+        return [int(i) for i in raw]
+    except (TypeError, ValueError, OverflowError):
+        return []
+
+
+def for_quiz(quiz) -> AnswerKey:
+    """Compiled key for the quiz's current content version."""
+    key = _keys.get(quiz.pk)
+    if key is not None and key.version == quiz.content_version:
+        return key
+    key = AnswerKey(quiz.pk, quiz.content_version, quiz.content)
+    with _lock:
+        if len(_keys) >= MAX_KEYS and quiz.pk not in _keys:
+            _keys.pop(next(iter(_keys)))  # oldest compiled quiz
+        _keys[quiz.pk] = key
+    return key
+
+
+def invalidate(quiz_id: int):
+    with _lock:
+        _keys.pop(quiz_id, None)
@@ -1,22 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
-from django.utils import timezone
 from django.contrib.auth import get_user_model
-from django.db.models import F
 
 from .models import (
-    LiveSession, LiveParticipant, LiveLeaderboard, OrgMembership, Course
+    LiveSession, Course, CourseEnrollment
 )
 from .constants import (
     ROLE_SUPERUSER, ROLE_ADMIN, ROLE_MANAGER, ROLE_TEACHER, ROLE_STUDENT, ROLE_PARENTS
 )
-from .permissions import allowed, READ_ONE, COURSE as COURSE_RES, LIVE_SESSION
-from .views import _get_idx_and_total, _set_idx_and_total  # reuse helpers
+from .permissions import allowed, memberships, READ_ONE, COURSE as COURSE_RES, LIVE_SESSION
+from . import answer_key, jobs, leaderboard, live_state, ongoing, roster
+from .views import _question_payload  # reuse helpers
 
 User = get_user_model()
 
@@ -41,33 +42,6 @@ def broadcast_course_session(session: LiveSession, op: str) -> None:
         {"type": "course.update", "payload": payload},
     )
 
-def _questions(session: LiveSession):
-    """Normalize quiz questions shape from session.quiz.content."""
-    content = session.quiz.content or []
-    out = []
-    for d in content:
-        out.append({
-            "question": d.get("question") or d.get("Question") or "",
-            "question_type": (d.get("question_type") or d.get("QuestionType") or "MCQ").upper(),
-            "image": d.get("image"),
-            "choices": d.get("choices") or d.get("Choices") or [],
-        })
-    return out
-
-def _evaluate(question: dict, selected_indexes):
-    """Return points for a selection according to question type (MCQ/MSQ)."""
-    try:
-        sel = {int(i) for i in selected_indexes}
-    except Exception:
-        sel = set()
-    correct = {i for i, ch in enumerate(question.get("choices") or []) if bool(ch.get("is_correct"))}
-    qtype = (question.get("question_type") or "").upper()
-    if qtype == "MSQ":
-        return 10 if sel == correct else 0
-    if len(sel) != 1:
-        return 0
-    return 10 if next(iter(sel)) in correct else 0
-
 # ----------------------- DB helpers (wrapped) -----------------------
 
 @database_sync_to_async
@@ -75,17 +49,20 @@ def _get_course(course_id: int):
     return Course.objects.select_related("organization", "teacher").filter(pk=course_id).first()
 
 @database_sync_to_async
-def _get_session(pk: int) -> LiveSession | None:
-    return (
+def _get_session(pk: int):
+    session = (
         LiveSession.objects
         .select_related("quiz", "quiz__course", "quiz__course__organization", "host")
         .filter(pk=pk)
         .first()
     )
+    if not session:
+        return None, None
+    return session, live_state.get_state(session)
 
 @database_sync_to_async
 def _actor_role_org(user):
-    mem = OrgMembership.objects.select_related("organization").filter(user=user).first()
+    mem = memberships(user).primary
     if not mem:
         return None, None
     return mem.role, mem.organization
@@ -98,14 +75,14 @@ def _can_view_course(user, course: Course) -> bool:
         return True
     if not allowed(user, READ_ONE, COURSE_RES, org=course.organization):
         return False
-    mem = OrgMembership.objects.select_related("organization").filter(user=user).first()
+    mem = memberships(user).primary
     role = mem.role if mem else None
     if role in {ROLE_ADMIN, ROLE_MANAGER}:
         return True
     if role == ROLE_TEACHER:
         return course.teacher_id == user.id
     if role in {ROLE_STUDENT, ROLE_PARENTS}:
-        return user.id in (course.enrolled_students or [])
+        return CourseEnrollment.objects.filter(course=course, user=user).exists()
     return False
 
 @database_sync_to_async
@@ -123,143 +100,70 @@ def _ongoing_sessions_rows(course: Course):
 def _can_read_session(user, session: LiveSession) -> bool:
     if user.is_authenticated and user.is_superuser:
         return True
-    mem = OrgMembership.objects.select_related("organization").filter(user=user).first()
-    if not mem:
+    if not memberships(user).primary:
         return False
     return allowed(user, READ_ONE, LIVE_SESSION, org=session.quiz.course.organization)
 
-@database_sync_to_async
-def _lobby_users_rows(session: LiveSession):
-    lobby_ids = list((session.details or {}).get("lobby", []))
-    if not lobby_ids:
-        return []
-    by_id = {
-        u["id"]: u
-        for u in User.objects.filter(id__in=lobby_ids).values(
-            "id", "username", "first_name", "last_name", "email"
-        )
-    }
-    return [by_id[i] for i in lobby_ids if i in by_id]
-
-@database_sync_to_async
-def _participants_rows(session: LiveSession):
-    return list(
-        LiveParticipant.objects.select_related("user")
-        .filter(livesession=session)
-        .exclude(user_id=session.host_id)
-        .annotate(
-            username=F("user__username"),
-            first_name=F("user__first_name"),
-            last_name=F("user__last_name"),
-            email=F("user__email"),
-        )
-        .values("user_id", "username", "first_name", "last_name", "email")
-    )
+_roster_snapshot = database_sync_to_async(roster.snapshot)
+_roster_delta = database_sync_to_async(roster.delta)
 
-@database_sync_to_async
-def _add_to_lobby(session: LiveSession, user_id: int):
-    d = dict(session.details or {})
-    lobby = set(d.get("lobby", []))
-    lobby.add(user_id)
-    d["lobby"] = list(lobby)
-    session.details = d
-    session.save(update_fields=["details"])
-    return d["lobby"]
+def _add_to_lobby(state: live_state.LiveState, user_id: int) -> dict:
+    changes = roster.join(state, user_id)
+    if changes:
+        live_state.touch(state)
+    return changes
 
 @database_sync_to_async
-def _admit_user(session: LiveSession, user_id: int):
-    d = dict(session.details or {})
-    lobby = set(d.get("lobby", []))
-    if user_id in lobby:
-        lobby.remove(user_id)
-        d["lobby"] = list(lobby)
-        session.details = d
-        session.save(update_fields=["details"])
-    LiveParticipant.objects.get_or_create(livesession=session, user_id=user_id)
-    return list(lobby)
+def _admit_user(state: live_state.LiveState, user_id: int) -> dict:
+    changes = roster.admit_waiting(state, user_id)
+    if changes:
+        live_state.touch(state)
+    return changes
 
 @database_sync_to_async
-def _start_session(session: LiveSession):
-    if session.started_at:
-        return _get_idx_and_total(session)
-    session.started_at = timezone.now()
-    lobby = list((session.details or {}).get("lobby", []))
-    for uid in lobby:
-        LiveParticipant.objects.get_or_create(livesession=session, user_id=uid)
-    d = dict(session.details or {})
-    d["lobby"] = []
-    session.details = d
-    session.save(update_fields=["started_at", "details"])
-    qs = _questions(session)
-    _set_idx_and_total(session, idx=0 if qs else -1, total=len(qs))
-    return _get_idx_and_total(session)
+def _start_session(session: LiveSession, state: live_state.LiveState) -> dict | None:
+    changes = roster.start(state, total=len(session.quiz.content or []))
+    if changes is not None:
+        live_state.touch(state)
+    return changes
 
 @database_sync_to_async
-def _next_or_end(session: LiveSession):
-    idx, total = _get_idx_and_total(session)
-    if 0 <= idx < total - 1:
-        _set_idx_and_total(session, idx=idx + 1, total=total)
-        return "next", idx + 1, total, None
+def _next_or_end(session: LiveSession, state: live_state.LiveState):
+    if state.advance():
+        live_state.touch(state)
+        return "next", state.current_index, state.total, None
     # End
-    session.ended_at = timezone.now()
-    session.save(update_fields=["ended_at"])
-    _recompute_leaderboard_sync(session)
-    rows = list(
-        LiveLeaderboard.objects.select_related("participant", "participant__user")
-        .filter(livesession=session).order_by("rank")
-        .values(
-            "rank", "score",
-            username=F("participant__user__username"),
-            first_name=F("participant__user__first_name"),
-            last_name=F("participant__user__last_name"),
-        )
-    )
-    return "ended", -1, total, rows
+    return "ended", -1, state.total, _finish_session(session, state)
 
 @database_sync_to_async
-def _end_session(session: LiveSession):
-    if not session.ended_at:
-        session.ended_at = timezone.now()
-        session.save(update_fields=["ended_at"])
-        _recompute_leaderboard_sync(session)
-    rows = list(
-        LiveLeaderboard.objects.select_related("participant", "participant__user")
-        .filter(livesession=session).order_by("rank")
-        .values(
-            "rank", "score",
-            username=F("participant__user__username"),
-            first_name=F("participant__user__first_name"),
-            last_name=F("participant__user__last_name"),
-        )
-    )
-    return rows
-
-def _recompute_leaderboard_sync(session: LiveSession):
-    rows = []
-    for p in LiveParticipant.objects.filter(livesession=session).only("id", "answer_questions", "user_id"):
-        answers = p.answer_questions or []
-        score = sum(int(a.get("points", 0)) for a in answers)
-        rows.append((p, score))
-    rows.sort(key=lambda t: t[1], reverse=True)
-    LiveLeaderboard.objects.filter(livesession=session).delete()
-    for rank, (p, score) in enumerate(rows, start=1):
-        LiveLeaderboard.objects.create(livesession=session, participant=p, rank=rank, score=score)
-
-@database_sync_to_async
-def _submit_answer(session: LiveSession, user_id: int, selected):
-    lp, _ = LiveParticipant.objects.get_or_create(livesession=session, user_id=user_id)
-    idx, total = _get_idx_and_total(session)
-    if not (0 <= idx < total):
+def _end_session(session: LiveSession, state: live_state.LiveState):
+    return _finish_session(session, state)
+
+def _finish_session(session: LiveSession, state: live_state.LiveState) -> leaderboard.FinalBoard:
+    """Persist the final state (sync, on a DB thread) and return the final board."""
+    if state.end():
+        live_state.touch(state)
+        session.ended_at = state.ended_at
+        leaderboard.freeze(session)
+        jobs.enqueue("live.finalise", session_id=session.pk)
+        live_state.discard(session.pk)
+    return leaderboard.final_board(session)
+
+_final_board = database_sync_to_async(leaderboard.final_board)
+_full_board = database_sync_to_async(leaderboard.full_rows)
+_live_board = database_sync_to_async(leaderboard.live_board)
+
+async def _submit_answer(session: LiveSession, state: live_state.LiveState, user_id: int, selected):
+    """Grade and queue an answer without touching the DB; waits only under back-pressure."""
+    idx, total = state.idx_and_total()
+    if state.ended or not (0 <= idx < total):
         return {"ended": True}
-    qs = _questions(session)
-    q = qs[idx]
-    answers = list(lp.answer_questions or [])
-    if any(int(a.get("question_id", -999)) == idx for a in answers):
+    sel = answer_key.parse_selected(selected)
+    points = answer_key.for_quiz(session.quiz).grade(idx, sel)
+    if not live_state.queue_answer(state, user_id, idx, sel, points):
         return {"already": True}
-    points = _evaluate(q, selected or [])
-    answers.append({"question_id": idx, "points": points, "selected": [int(i) for i in (selected or [])]})
-    lp.answer_questions = answers
-    lp.save(update_fields=["answer_questions"])
+    if live_state.pending_answers() >= live_state.MAX_PENDING_ANSWERS:
+        await live_state.flush()
     return {"ok": True, "points": points}
 
 # ----------------------- Consumers -----------------------
@@ -289,11 +193,44 @@ class CourseSessionsConsumer(AsyncJsonWebsocketConsumer):
         # payload: {"op": "create"|"update"|"remove", "session": {...}}
         await self.send_json({"type": "update", **event["payload"]})
 
+class OngoingSessionsConsumer(AsyncJsonWebsocketConsumer):
+    """Dashboard feed: ongoing sessions for the user's scope, then create/update/remove deltas."""
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if not user or not user.is_authenticated:
+            await self.close()
+            return
+        self.feed = await database_sync_to_async(ongoing.scope_for)(user)
+        if self.feed is None:
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(self.feed.group, self.channel_name)
+        await self.accept()
+
+        sessions = await database_sync_to_async(ongoing.snapshot)(self.feed)
+        await self.send_json({"type": "snapshot", "sessions": sessions})
+
+    async def disconnect(self, code):
+        if getattr(self, "feed", None):
+            await self.channel_layer.group_discard(self.feed.group, self.channel_name)
+
+    # Group push → client (filtered to what this dashboard shows)
+    async def ongoing_update(self, event):
+        payload = event["payload"]
+        ongoing.receive(payload)  # keep this process's index current for HTTP dashboards
+        if self.feed.sees(payload["session"]):
+            await self.send_json({"type": "update", **payload})
+
 class LiveSessionConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.session_id = int(self.scope["url_route"]["kwargs"]["pk"])
-        self.group_name = f"live_{self.session_id}"
-        self.session = await _get_session(self.session_id)
+        self.group_name = f"live_{self.session_id}"            # everyone: state + events
+        self.staff_group = roster.staff_group(self.session_id)  # host/staff: + roster deltas
+        # self.state is the process-wide LiveState shared by every socket of this session
+        self.session, self.state = await _get_session(self.session_id)
+        self.board_task = None  # host's live leaderboard stream, once requested
 
         user = self.scope.get("user")
         if not self.session or not user or not user.is_authenticated:
@@ -307,26 +244,49 @@ class LiveSessionConsumer(AsyncJsonWebsocketConsumer):
                 await self.close()
                 return
 
+        self.is_staff = roster.is_staff(user, role, self.session)
         await self.channel_layer.group_add(self.group_name, self.channel_name)
+        if self.is_staff:
+            await self.channel_layer.group_add(self.staff_group, self.channel_name)
         await self.accept()
 
-        idx, total = _get_idx_and_total(self.session)
-        lobby_users = await _lobby_users_rows(self.session)
-        participants = await _participants_rows(self.session)
-
-        await self.send_json({
+        idx, total = self.state.idx_and_total()
+        live = self.state.started and not self.state.ended
+        snapshot = {
             "type": "snapshot",
             "is_host": user.id == self.session.host_id,
-            "started": bool(self.session.started_at),
-            "ended": bool(self.session.ended_at),
+            "started": self.state.started,
+            "ended": self.state.ended,
             "current_index": idx,
             "total": total,
-            "lobby_users": lobby_users,
-            "participants": participants,
-        })
+            "question": _question_payload(self.session, idx, total) if live else None,
+        }
+        if self.is_staff:
+            snapshot["roster"] = await _roster_snapshot(self.state)
+        await self.send_json(snapshot)
 
     async def disconnect(self, code):
+        if self.board_task:
+            self.board_task.cancel()
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await self.channel_layer.group_discard(self.staff_group, self.channel_name)
+
+    async def _stream_board(self, k: int):
+        """Push the live top k to this socket when the ranking moved, at most every LIVE_INTERVAL."""
+        ranking, seen = self.state.ranking, None
+        while not self.state.ended:
+            if ranking.version != seen:
+                seen = ranking.version
+                await self.send_json({"type": "leaderboard", "live": True, **await _live_board(ranking, k)})
+            await asyncio.sleep(leaderboard.LIVE_INTERVAL)
+
+    async def _send_roster(self, delta: dict | None):
+        """Roster delta to the staff group only (audience sockets never see rosters)."""
+        if delta:
+            await self.channel_layer.group_send(self.staff_group, {
+                "type": "session.update",
+                "payload": {"roster": delta},
+            })
 
     async def receive_json(self, content, **kwargs):
         user = self.scope["user"]
@@ -336,26 +296,28 @@ class LiveSessionConsumer(AsyncJsonWebsocketConsumer):
 
         # Student joins lobby
         if action == "join_lobby":
-            await _add_to_lobby(self.session, user.id)
-            lobby_users = await _lobby_users_rows(self.session)
-            await self.channel_layer.group_send(self.group_name, {
-                "type": "session.update",
-                "payload": {"lobby_users": lobby_users},
-            })
+            changes = _add_to_lobby(self.state, user.id)
+            if changes:
+                await self._send_roster(await _roster_delta(self.state, **changes))
+            return
+
+        # Roster resync after a sequence gap (this socket only)
+        if action == "roster" and self.is_staff:
+            await self.send_json({"type": "roster", **await _roster_snapshot(self.state)})
             return
 
         # Host actions
         is_host = (user.id == self.session.host_id)
 
         if action == "admit" and is_host:
-            uid = int(content.get("user_id") or 0)
-            await _admit_user(self.session, uid)
-            lobby_users = await _lobby_users_rows(self.session)
-            participants = await _participants_rows(self.session)
-            await self.channel_layer.group_send(self.group_name, {
-                "type": "session.update",
-                "payload": {"lobby_users": lobby_users, "participants": participants},
-            })
+            try:
+                uid = int(content.get("user_id") or 0)
+            except (TypeError, ValueError):
+                return
+            changes = await _admit_user(self.state, uid)
+            if not changes:
+                return  # not waiting in the lobby
+            await self._send_roster(await _roster_delta(self.state, **changes))
             await self.channel_layer.group_send(self.group_name, {
                 "type": "session.event",
                 "payload": {"kind": "admitted", "user_id": uid},
@@ -363,71 +325,85 @@ class LiveSessionConsumer(AsyncJsonWebsocketConsumer):
             return
 
         if action == "start" and is_host:
-            idx, total = await _start_session(self.session)
-            participants = await _participants_rows(self.session)
+            changes = await _start_session(self.session, self.state)
+            idx, total = self.state.idx_and_total()
+            self.session.started_at = self.state.started_at
+            await self._send_roster(await _roster_delta(self.state, **(changes or {})))
 
             # Update Live page
             await self.channel_layer.group_send(self.group_name, {
-                "type": "session.update",
-                "payload": {
+                "type": "session.message",
+                "update": {
                     "started": True,
                     "current_index": idx,
                     "total": total,
-                    "lobby_users": [],
-                    "participants": participants,
+                    "question": _question_payload(self.session, idx, total),
                 },
-            })
-            await self.channel_layer.group_send(self.group_name, {
-                "type": "session.event",
-                "payload": {"kind": "started"},
+                "event": {"kind": "started"},
             })
 
-            # Update Course page (started_at column)
+            # Update Course page (started_at column) and dashboards
             await self.channel_layer.group_send(
                 f"course_{self.session.quiz.course_id}",
                 {"type": "course.update",
                  "payload": {"op": "update", "session": _serialize_session_for_course(self.session)}},
             )
+            await ongoing.apublish(self.session, "update")
             return
 
         if action == "next" and is_host:
-            status, idx, total, rows = await _next_or_end(self.session)
+            status, idx, total, board = await _next_or_end(self.session, self.state)
             if status == "next":
                 await self.channel_layer.group_send(self.group_name, {
-                    "type": "session.update",
-                    "payload": {"current_index": idx, "total": total},
-                })
-                await self.channel_layer.group_send(self.group_name, {
-                    "type": "session.event",
-                    "payload": {"kind": "question_changed"},
+                    "type": "session.message",
+                    "update": {
+                        "current_index": idx,
+                        "total": total,
+                        "question": _question_payload(self.session, idx, total),
+                    },
+                    "event": {"kind": "question_changed"},
                 })
             else:
                 # Ended
                 await self.channel_layer.group_send(self.group_name, {
-                    "type": "session.update",
-                    "payload": {"ended": True, "leaderboard": rows},
+                    "type": "session.ended",
+                    "payload": board.payload(),
                 })
                 await self.channel_layer.group_send(
                     f"course_{self.session.quiz.course_id}",
                     {"type": "course.update", "payload": {"op": "remove", "session": {"id": self.session.id}}},
                 )
+                await ongoing.apublish(self.session, "remove")
             return
 
         if action == "end" and is_host:
-            rows = await _end_session(self.session)
+            board = await _end_session(self.session, self.state)
             await self.channel_layer.group_send(self.group_name, {
-                "type": "session.update",
-                "payload": {"ended": True, "leaderboard": rows},
+                "type": "session.ended",
+                "payload": board.payload(),
             })
             await self.channel_layer.group_send(
                 f"course_{self.session.quiz.course_id}",
                 {"type": "course.update", "payload": {"op": "remove", "session": {"id": self.session.id}}},
             )
+            await ongoing.apublish(self.session, "remove")
+            return
+
+        # Host: the whole final board, or a throttled live top-k stream while running
+        if action == "leaderboard" and is_host:
+            if self.board_task:
+                self.board_task.cancel()
+                self.board_task = None
+            if self.state.ended:
+                rows = await _full_board(self.session)
+                await self.send_json({"type": "leaderboard", "rows": rows, "total": len(rows)})
+            else:
+                self.board_task = asyncio.create_task(self._stream_board(leaderboard.board_size(content.get("k"))))
             return
 
         if action == "answer":
             selected = content.get("selected") or []
-            res = await _submit_answer(self.session, user.id, selected)
+            res = await _submit_answer(self.session, self.state, user.id, selected)
             await self.send_json({"type": "answer_ack", **(res or {})})
             return
 
@@ -437,3 +413,14 @@ class LiveSessionConsumer(AsyncJsonWebsocketConsumer):
 
     async def session_event(self, event):
         await self.send_json({"type": "event", **event["payload"]})
+
+    async def session_ended(self, event):
+        # shared top-N plus this socket's own line, looked up in the in-process board
+        board = leaderboard.peek_board(self.session_id) or await _final_board(self.session)
+        me = board.standing(self.scope["user"].id)
+        await self.send_json({"type": "update", **event["payload"], "me": me})
+
+    async def session_message(self, event):
+        # update + event from one group message (one fan-out per transition)
+        await self.send_json({"type": "update", **event["update"]})
+        await self.send_json({"type": "event", **event["event"]})
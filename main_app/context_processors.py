@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .permissions import capabilities
+
+
+def permissions(request):
+    """Expose the user's capability map as `caps`; built on first use only."""
+    return {"caps": SimpleLazyObject(lambda: capabilities(request.user))}
@@ -0,0 +1,130 @@
+"""
+Per-session results exports (CSV and XLSX) that never hold the whole table.
+
+result_batches() yields the header and then participant rows (rank, who,
+score, and points + selected choices per question) one keyset-paginated batch
+at a time: each batch is one participants query and one answers query, so
+memory stays at a batch whatever the session size and no cursor is held open
+between batches.
+
+CSV is streamed batch by batch. XLSX is written with xlsxwriter's
+constant_memory mode into a temporary file, which is then streamed in blocks.
+Under ASGI, Django drains a synchronous iterator into a list before sending
+(StreamingHttpResponse.__aiter__), so streaming_content() hands ASGI requests
+an async iterator that pulls each chunk on a worker thread instead.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import tempfile
+
+import xlsxwriter
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+from .models import LiveAnswer, LiveParticipant
+
+EXPORT_BATCH_SIZE = 500      # participants per query
+FILE_CHUNK_SIZE = 64 * 1024  # bytes per streamed XLSX block
+CSV_CONTENT_TYPE = "text/csv; charset=utf-8"
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def header(questions) -> list[str]:
+    head = ["Rank", "Username", "Name", "Email", "Score"]
+    for i in range(len(questions)):
+        head += [f"Q{i + 1} points", f"Q{i + 1} selected"]
+    return head
+
+
+def result_batches(session, questions, batch_size: int = EXPORT_BATCH_SIZE):
+    """Yield [header], then lists of participant rows ordered by username."""
+    yield [header(questions)]
+    texts = [
+        [ch.get("text") or f"Choice {i + 1}" for i, ch in enumerate(q.get("choices") or [])]
+        for q in questions
+    ]
+    base = (
+        LiveParticipant.objects.filter(livesession=session)
+        .order_by("user__username")
+        .values_list(
+            "id", "user__username", "user__first_name", "user__last_name", "user__email",
+            "leaderboard_row__rank", "leaderboard_row__score",
+        )
+    )
+    last = None
+    while True:
+        page = list((base if last is None else base.filter(user__username__gt=last))[:batch_size])
+        if not page:
+            return
+        last = page[-1][1]
+
+        # [points, selected] per question for each participant in the page
+        cells = {pid: [[0, ""] for _ in questions] for pid, *_ in page}
+        answers = LiveAnswer.objects.filter(participant_id__in=cells).values_list(
+            "participant_id", "question_index", "selected", "points"
+        )
+        for pid, idx, selected, points in answers:
+            if idx < len(questions):
+                choices = texts[idx]
+                cells[pid][idx] = [points, "; ".join(choices[i] for i in selected or [] if 0 <= i < len(choices))]
+
+        rows = []
+        for pid, username, first, last_name, email, rank, score in page:
+            row = [rank or "", username, f"{first} {last_name}".strip(), email, score or 0]
+            for points, selected in cells[pid]:
+                row += [points, selected]
+            rows.append(row)
+        yield rows
+
+
+def csv_chunks(batches):
+    """One CSV text chunk per batch; starts with a BOM so spreadsheet apps read UTF-8."""
+    yield "\ufeff"
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def xlsx_file(batches, sheet_name: str = "Results"):
+    """Write the batches to a temporary .xlsx (constant memory); returns (file at 0, size)."""
+    out = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(out, {"constant_memory": True})
+    sheet = workbook.add_worksheet(sheet_name)
+    bold = workbook.add_format({"bold": True})
+    r = 0
+    for rows in batches:
+        for row in rows:
+            sheet.write_row(r, 0, row, bold if r == 0 else None)
+            r += 1
+    sheet.freeze_panes(1, 0)
+    workbook.close()
+    size = out.tell()
+    out.seek(0)
+    return out, size
+
+
+def file_chunks(f, chunk_size: int = FILE_CHUNK_SIZE):
+    try:
+        while block := f.read(chunk_size):
+            yield block
+    finally:
+        f.close()
+
+
+async def _pull(chunks):
+    step = sync_to_async(next)
+    while (chunk := await step(chunks, None)) is not None:
+        yield chunk
+
+
+def streaming_content(request, chunks):
+    """chunks as StreamingHttpResponse content that streams under both WSGI and ASGI."""
+    if isinstance(request, ASGIRequest):
+        return _pull(iter(chunks))
+    return chunks
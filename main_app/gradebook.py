@@ -0,0 +1,100 @@
+"""
+Course gradebook: every student's final score in every ended session of a course.
+
+matrix() loads the course's LiveLeaderboard scores in one query and pivots
+them into a students x sessions table with pandas, instead of reading each
+session page. Enrolled students with no scores still get a (blank) row.
+
+The result is cached under a stamp of the course's ended sessions (how many,
+and when the latest ended / was finalised), so a cached gradebook is reused
+until another session in the course ends. Sessions whose finalise job has not
+run yet are finalised first, so their scores are not missing.
+"""
+from __future__ import annotations
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .leaderboard import ensure_final
+from .models import CourseEnrollment, LiveLeaderboard, LiveSession
+
+User = get_user_model()
+
+CACHE_TTL = 24 * 60 * 60  # seconds; the stamp already changes when a session ends
+BATCH_SIZE = 500          # rows per streamed chunk
+
+
+def _ended_sessions(course):
+    return LiveSession.objects.filter(quiz__course=course, ended_at__isnull=False)
+
+
+def _stamp(course) -> str:
+    agg = _ended_sessions(course).aggregate(
+        n=Count("id"), ended=Max("ended_at"), finalised=Max("leaderboard_finalised_at")
+    )
+    return ":".join(str(v.timestamp() if hasattr(v, "timestamp") else v) for v in agg.values())
+
+
+def build(course) -> dict:
+    """{"header": [...], "rows": [[...], ...]} with one column per ended session."""
+    import pandas as pd  # heavy; only needed on a cache miss
+
+    sessions = list(
+        _ended_sessions(course).order_by("ended_at", "id").values_list("id", "quiz__quiz_title", "ended_at")
+    )
+    session_ids = [sid for sid, _, _ in sessions]
+    scores = pd.DataFrame.from_records(
+        LiveLeaderboard.objects.filter(livesession_id__in=session_ids)
+        .values_list("participant__user_id", "livesession_id", "score"),
+        columns=["user_id", "session_id", "score"],
+    )
+    user_ids = set(scores["user_id"].tolist())
+    user_ids.update(CourseEnrollment.objects.filter(course=course).values_list("user_id", flat=True))
+    students = list(
+        User.objects.filter(id__in=user_ids).order_by("username")
+        .values_list("id", "username", "first_name", "last_name", "email")
+    )
+
+    grid = (
+        scores.pivot_table(index="user_id", columns="session_id", values="score", aggfunc="sum")
+        if len(scores) else pd.DataFrame(dtype=float)
+    ).reindex(index=[uid for uid, *_ in students], columns=session_ids)
+    total = grid.sum(axis=1)
+    attended = grid.notna().sum(axis=1)
+    average = grid.mean(axis=1).round(2)
+
+    header = ["Username", "Name", "Email"]
+    header += [f"{title} #{sid} ({timezone.localtime(ended):%Y-%m-%d})" for sid, title, ended in sessions]
+    header += ["Total", "Sessions", "Average"]
+
+    rows = []
+    for (uid, username, first, last, email), cells, t, n, avg in zip(
+        students, grid.to_numpy(), total.to_numpy(), attended.to_numpy(), average.to_numpy()
+    ):
+        row = [username, f"{first} {last}".strip(), email]
+        row += [None if c != c else int(c) for c in cells]  # NaN: did not take part
+        row += [int(t), int(n), None if avg != avg else float(avg)]
+        rows.append(row)
+    return {"header": header, "rows": rows}
+
+
+def matrix(course) -> dict:
+    """The course's gradebook, rebuilt only after another session in it has ended."""
+    for session in _ended_sessions(course).filter(leaderboard_finalised_at__isnull=True):
+        ensure_final(session)
+    key = f"gradebook:{course.pk}:{_stamp(course)}"
+    data = cache.get(key)
+    if data is None:
+        data = build(course)
+        cache.set(key, data, CACHE_TTL)
+    return data
+
+
+def batches(data: dict, batch_size: int = BATCH_SIZE):
+    """[header], then the rows in chunks (the shape exports.csv_chunks/xlsx_file take)."""
+    yield [data["header"]]
+    rows = data["rows"]
+    for i in range(0, len(rows), batch_size):
+        yield rows[i:i + batch_size]
@@ -0,0 +1,214 @@
+"""
+DB-backed background jobs, run by `manage.py run_jobs`.
+
+Heavy work that used to run inside a request or consumer action (writing a
+session's final leaderboard, building its answers report, exports) is queued
+as a Job row instead and picked up by a worker process. The Job table is the
+whole queue, so nothing beyond the database is needed:
+
+    job = jobs.enqueue("live.export", user=request.user, session_id=42, fmt="xlsx")
+    # ... the client polls /jobs/<id>/ for status and progress
+
+Workers claim a job with a conditional UPDATE (status queued -> running), so
+two workers never run the same job on any backend. A failing job is retried
+with a growing delay up to MAX_ATTEMPTS. A running job whose heartbeat stops
+(worker killed) is requeued by requeue_stale(). Handlers may therefore run more
+than once and must be idempotent.
+
+Handlers are registered with @handler(kind) and called as fn(job, **payload);
+they report progress with report(job, percent, message) and return a
+JSON-serialisable result (stored on the job). A handler that writes a file
+saves it to `files` and returns its name under "file", which /jobs/<id>/download/
+then serves to the job's owner.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import tempfile
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+from django.utils import timezone
+
+from . import exports, leaderboard, reports
+from .models import Job, LiveParticipant, LiveSession
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3     # runs before a job is marked failed
+RETRY_DELAY = 30     # seconds before the first retry; doubled for each further one
+STALE_AFTER = 600    # seconds without a heartbeat before a running job is requeued
+CLAIM_WINDOW = 10    # queued ids a worker tries per claim before giving up
+
+# Job output is private (results, grades), so it is kept outside MEDIA_ROOT
+files = FileSystemStorage(location=getattr(settings, "JOB_FILES_ROOT", settings.BASE_DIR / "job_files"))
+
+_handlers: dict = {}
+
+
+def handler(kind: str):
+    """Register fn(job, **payload) -> result as the handler for a job kind."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind: str, user=None, delay: float = 0, **payload) -> Job:
+    """
+    Queue a job (payload must be JSON-serialisable).
+
+    The row is written in the caller's transaction, so a job queued inside one
+    is only seen by workers once the work it depends on is committed.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    return Job.objects.create(
+        kind=kind,
+        payload=payload,
+        created_by=user if user is not None and user.is_authenticated else None,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def report(job: Job, progress: int, message: str = ""):
+    """Record a running job's progress (0-100) and refresh its heartbeat."""
+    job.progress = max(0, min(int(progress), 100))
+    job.message = message[:255]
+    Job.objects.filter(pk=job.pk).update(
+        progress=job.progress, message=job.message, heartbeat_at=timezone.now()
+    )
+
+
+def status(job: Job) -> dict:
+    """What a polling client sees."""
+    return {
+        "id": job.pk,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "result": job.result,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# ----------------------- Worker side -----------------------
+
+def claim(worker: str) -> Job | None:
+    """Take the oldest due job for this worker, or None if there is none."""
+    now = timezone.now()
+    due = (
+        Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+        .order_by("id")
+        .values_list("id", flat=True)[:CLAIM_WINDOW]
+    )
+    for pk in due:
+        won = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if won:  # another worker may have taken it between the select and the update
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run(job: Job) -> bool:
+    """Run a claimed job and record the outcome; True if it succeeded."""
+    fn = _handlers.get(job.kind)
+    try:
+        if fn is None:
+            raise LookupError(f"No handler for job kind {job.kind!r}")
+        result = fn(job, **job.payload)
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed on attempt %s", job.pk, job.kind, job.attempts)
+        now = timezone.now()
+        fields = {"error": traceback.format_exc(), "message": str(exc)[:255], "worker": ""}
+        if fn is not None and job.attempts < MAX_ATTEMPTS:
+            fields.update(status=Job.QUEUED, run_after=now + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1)))
+        else:
+            fields.update(status=Job.FAILED, finished_at=now)
+        Job.objects.filter(pk=job.pk).update(**fields)
+        return False
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.DONE, progress=100, result=result, error="", finished_at=timezone.now()
+    )
+    return True
+
+
+def requeue_stale(stale_after: int = STALE_AFTER) -> int:
+    """Requeue running jobs whose worker stopped reporting (failing those out of attempts)."""
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=now - timedelta(seconds=stale_after))
+    message = "Worker stopped responding"
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=Job.FAILED, message=message, error=message, finished_at=now
+    )
+    return failed + stale.update(status=Job.QUEUED, message=message, worker="", run_after=now)
+
+
+# ----------------------- Handlers -----------------------
+
+def _session(session_id: int):
+    return LiveSession.objects.select_related("quiz").filter(pk=session_id, ended_at__isnull=False).first()
+
+
+def _quiz_questions(session):
+    from .views import _quiz_questions  # views imports this module
+    return _quiz_questions(session)
+
+
+@handler("live.finalise")
+def finalise_session(job: Job, session_id: int):
+    """Write an ended session's LiveLeaderboard rows and store its answers report."""
+    session = _session(session_id)
+    if session is None:
+        return {"skipped": "session not found or not ended"}
+    finalised = leaderboard.ensure_final(session)
+    report(job, 50, "Leaderboard finalised")
+    reports.answers_report(session, _quiz_questions(session))
+    return {"finalised": finalised}
+
+
+@handler("live.export")
+def export_session(job: Job, session_id: int, fmt: str):
+    """The session's results export (exports.result_batches) written to a job file."""
+    if fmt not in {"csv", "xlsx"}:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    session = _session(session_id)
+    if session is None:
+        raise LookupError(f"Session {session_id} not found or not ended")
+    leaderboard.ensure_final(session)
+    total = LiveParticipant.objects.filter(livesession=session).count()
+
+    def counted(batches):
+        done = 0
+        for rows in batches:
+            yield rows
+            done += len(rows)
+            report(job, 99 * done // (total + 1), f"{max(done - 1, 0)} of {total} participants")
+
+    batches = counted(exports.result_batches(session, _quiz_questions(session)))
+    if fmt == "csv":
+        out = tempfile.TemporaryFile()
+        for chunk in exports.csv_chunks(batches):
+            out.write(chunk.encode("utf-8"))
+        size = out.tell()
+        out.seek(0)
+    else:
+        out, size = exports.xlsx_file(batches)
+    with out:
+        name = files.save(f"exports/session-{session_id}-results-{job.pk}.{fmt}", File(out))
+    return {"file": name, "filename": f"session-{session_id}-results.{fmt}", "size": size}
@@ -0,0 +1,349 @@
+"""
+Incremental leaderboard for live sessions.
+
+Ranking keeps a running total per user plus a list of (-score, user_id) keys
+kept sorted with bisect, so an answer costs two O(log n) searches instead of
+re-summing every participant's answers.
+
+When a session ends, its standings are frozen into a FinalBoard: the top rows
+everyone is shown plus a user_id -> (rank, score) map, so each client gets the
+shared top-N and its own line instead of the whole board. Writing the
+LiveLeaderboard rows (finalise) is left to the "live.finalise" background job;
+readers that get there first call ensure_final() and write them inline.
+
+While a session runs, hosts get the top K from the same Ranking: live_board()
+names only those K users, and Ranking.version lets a stream skip pushes when
+nothing scored since the last one.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from typing import NamedTuple
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import legacy_answers
+from .models import LiveSession, LiveParticipant, LiveLeaderboard
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 500
+FINAL_CACHE_TTL = 600  # seconds
+TOP_N = 10             # final rows every client is sent
+LIVE_TOP_K = 10        # default rows in the host's live board
+LIVE_MAX_K = 100
+LIVE_INTERVAL = 1.0    # seconds; at most one live board push per host socket
+MAX_BOARDS = 64        # ended sessions' boards kept per process
+
+_boards_lock = threading.Lock()
+_finalise_lock = threading.RLock()  # held by ensure_final across its check and finalise()
+_boards: dict[int, "FinalBoard"] = {}
+
+
+def final_cache_key(session_id: int) -> str:
+    return f"live:{session_id}:final_leaderboard"
+
+
+def load_scores(session_id: int) -> dict[int, int]:
+    """{user_id: total points} for every participant, summed in the DB."""
+    rows = (
+        LiveParticipant.objects.filter(livesession_id=session_id)
+        .annotate(total=Coalesce(Sum("answers__points"), 0))
+        .values_list("user_id", "total")
+    )
+    return dict(rows)
+
+
+class Ranking:
+    """Per-session running totals ordered by score (desc), then user id."""
+
+    def __init__(self, scores=None):
+        self._lock = threading.Lock()
+        self._scores: dict[int, int] = dict(scores or {})
+        self._order = sorted((-s, uid) for uid, s in self._scores.items())
+        self.version = 0  # bumped on every change, for cheap "anything new?" checks
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def add(self, user_id: int, points: int = 0) -> int:
+        """Add points for a user (registering them at 0 if new); return the new total."""
+        with self._lock:
+            old = self._scores.get(user_id)
+            if old is not None:
+                if not points:
+                    return old
+                del self._order[bisect_left(self._order, (-old, user_id))]
+            new = (old or 0) + points
+            self._scores[user_id] = new
+            insort(self._order, (-new, user_id))
+            self.version += 1
+            return new
+
+    def score(self, user_id: int) -> int:
+        return self._scores.get(user_id, 0)
+
+    def position(self, user_id: int) -> int | None:
+        """1-based position in the ordering, or None if the user has no entry."""
+        with self._lock:
+            s = self._scores.get(user_id)
+            if s is None:
+                return None
+            return bisect_left(self._order, (-s, user_id)) + 1
+
+    def top(self, n: int | None = None):
+        """[(user_id, score), ...] best first; all entries when n is None."""
+        with self._lock:
+            keys = self._order if n is None else self._order[:n]
+            return [(uid, -neg) for neg, uid in keys]
+
+    def dense(self, n: int | None = None):
+        """[(rank, user_id, score), ...] with dense, tie-aware ranks (1, 1, 2, ...)."""
+        out, rank, prev = [], 0, None
+        for uid, score in self.top(n):
+            if score != prev:
+                rank, prev = rank + 1, score
+            out.append((rank, uid, score))
+        return out
+
+
+def finalise(session, ranking: Ranking) -> dict | None:
+    """
+    Write the session's LiveLeaderboard rows from the ranking in one transaction.
+
+    Ranks are dense (equal scores share a rank, the next score gets rank + 1).
+    Existing rows are bulk-updated, missing ones bulk-created and stale ones
+    deleted, so the cost is a handful of statements whatever the session size.
+    Keeps the FinalBoard in this process for the end-of-session broadcast.
+
+    Pages, sockets and the finalise job may all get here at once. The
+    transaction therefore starts by claiming LiveSession.leaderboard_finalised_at
+    with a conditional UPDATE: the row lock makes other processes wait for
+    this commit and then find the marker set, and _finalise_lock does the same
+    for this process's threads (SQLite has no row locks). Whoever loses the
+    claim writes nothing and gets None; the winner gets row counts and the
+    elapsed time in milliseconds.
+    """
+    t0 = time.perf_counter()
+    pid_by_user = dict(
+        LiveParticipant.objects.filter(livesession=session).values_list("user_id", "id")
+    )
+    dense = [(rank, uid, score) for rank, uid, score in ranking.dense() if uid in pid_by_user]
+    wanted = {pid_by_user[uid]: (rank, score) for rank, uid, score in dense}
+
+    with _finalise_lock, transaction.atomic():
+        now = timezone.now()
+        claimed = LiveSession.objects.filter(pk=session.pk, leaderboard_finalised_at__isnull=True).update(
+            leaderboard_finalised_at=now
+        )
+        if not claimed:
+            session.leaderboard_finalised_at = (
+                LiveSession.objects.filter(pk=session.pk).values_list("leaderboard_finalised_at", flat=True).first()
+            )
+            return None
+        existing = {
+            row.participant_id: row
+            for row in LiveLeaderboard.objects.filter(livesession=session).only("id", "participant_id", "rank", "score")
+        }
+        to_update, to_create = [], []
+        for pid, (rank, score) in wanted.items():
+            row = existing.pop(pid, None)
+            if row is None:
+                to_create.append(LiveLeaderboard(livesession=session, participant_id=pid, rank=rank, score=score))
+            elif (row.rank, row.score) != (rank, score):
+                row.rank, row.score = rank, score
+                to_update.append(row)
+        if existing:
+            LiveLeaderboard.objects.filter(pk__in=[r.pk for r in existing.values()]).delete()
+        if to_update:
+            LiveLeaderboard.objects.bulk_update(to_update, ["rank", "score"], batch_size=BULK_BATCH_SIZE)
+        if to_create:
+            LiveLeaderboard.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+    session.leaderboard_finalised_at = now
+    cache.delete(final_cache_key(session.pk))
+    _remember(session.pk, FinalBoard.build(dense))
+
+    stats = {
+        "rows": len(wanted),
+        "created": len(to_create),
+        "updated": len(to_update),
+        "deleted": len(existing),
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
+    logger.info("Leaderboard finalised for session %s: %s", session.pk, stats)
+    return stats
+
+
+def ensure_final(session) -> bool:
+    """
+    Finalise an ended session whose rows are not written yet; True if this call wrote them.
+
+    That is a session whose "live.finalise" job has not run, or a legacy one
+    that ended before the marker existed; afterwards this is a no-op. A legacy
+    session's JSON answers are copied to LiveAnswer first (exports and reports
+    read them there), and rows it already has were written by the old
+    end-of-session code, so they are kept as they are and only the marker set.
+    """
+    if session.leaderboard_finalised_at is not None:
+        return False
+    with _finalise_lock:
+        # another thread or the job may have finalised it since this instance was loaded
+        session.leaderboard_finalised_at = (
+            LiveSession.objects.filter(pk=session.pk).values_list("leaderboard_finalised_at", flat=True).first()
+        )
+        if session.leaderboard_finalised_at is not None:
+            return False
+        legacy_answers.copy_session(session.pk)
+        if LiveLeaderboard.objects.filter(livesession=session).exists():
+            now = timezone.now()
+            LiveSession.objects.filter(pk=session.pk, leaderboard_finalised_at__isnull=True).update(
+                leaderboard_finalised_at=now
+            )
+            session.leaderboard_finalised_at = now
+            return False
+        return finalise(session, Ranking(load_scores(session.pk))) is not None
+
+
+def final_rows(session):
+    """Final LiveLeaderboard rows of an ended session (a cached read on the (livesession, rank) index)."""
+    key = final_cache_key(session.pk)
+    rows = cache.get(key)
+    if rows is None:
+        ensure_final(session)
+        rows = list(
+            LiveLeaderboard.objects.select_related("participant", "participant__user")
+            .filter(livesession=session)
+            .order_by("rank", "participant__user__username")
+        )
+        cache.set(key, rows, FINAL_CACHE_TTL)
+    return rows
+
+
+# ----------------------- Board rows -----------------------
+
+def _named(head) -> list[dict]:
+    """Rows for (rank, user_id, score) triples, with names from one query."""
+    users = User.objects.in_bulk([uid for _, uid, _ in head])
+    return [
+        {
+            "rank": rank, "score": score, "user_id": uid,
+            "username": users[uid].username,
+            "first_name": users[uid].first_name,
+            "last_name": users[uid].last_name,
+            "name": users[uid].get_full_name() or users[uid].username,
+        }
+        for rank, uid, score in head if uid in users
+    ]
+
+
+def board_size(raw) -> int:
+    """A requested k (query string, WS field) clamped to 1..LIVE_MAX_K."""
+    try:
+        k = int(raw or LIVE_TOP_K)
+    except (TypeError, ValueError):
+        k = LIVE_TOP_K
+    return max(1, min(k, LIVE_MAX_K))
+
+
+def live_board(ranking: Ranking, k: int = LIVE_TOP_K) -> dict:
+    """Top k rows of a running session and how many are ranked (sync; one query for k names)."""
+    return {"rows": _named(ranking.dense(k)), "total": len(ranking)}
+
+
+# ----------------------- End-of-session delivery -----------------------
+
+class FinalBoard(NamedTuple):
+    top: list         # [{"rank", "score", "user_id", "username", "first_name", "last_name"}, ...]
+    standings: dict   # user_id -> (rank, score) for every ranked participant
+
+    @classmethod
+    def build(cls, dense) -> "FinalBoard":
+        """From (rank, user_id, score) best first; one query for the top rows' names."""
+        standings, head = {}, []
+        for rank, uid, score in dense:
+            standings[uid] = (rank, score)
+            if len(head) < TOP_N:
+                head.append((rank, uid, score))
+        return cls(_named(head), standings)
+
+    def standing(self, user_id: int) -> dict | None:
+        """The user's own line ({"rank", "score", "of"}), or None if they were not ranked."""
+        entry = self.standings.get(user_id)
+        if entry is None:
+            return None
+        return {"rank": entry[0], "score": entry[1], "of": len(self.standings)}
+
+    def payload(self) -> dict:
+        """What every socket shares at the end (each adds its own "me")."""
+        return {"ended": True, "leaderboard": self.top, "participants": len(self.standings)}
+
+
+def _remember(session_id: int, board: FinalBoard):
+    with _boards_lock:
+        if len(_boards) >= MAX_BOARDS and session_id not in _boards:
+            _boards.pop(next(iter(_boards)))  # oldest ended session
+        _boards[session_id] = board
+
+
+def freeze(session) -> FinalBoard:
+    """
+    The just-ended session's FinalBoard, without writing rows.
+
+    Built from the stored answers (one aggregate query) rather than a
+    process's in-memory ranking, so the board matches the rows finalise()
+    will write even if answers raced in from several processes.
+    """
+    board = FinalBoard.build(Ranking(load_scores(session.pk)).dense())
+    _remember(session.pk, board)
+    return board
+
+
+def peek_board(session_id: int) -> FinalBoard | None:
+    """This process's board for an ended session, if it has one (no DB access)."""
+    with _boards_lock:
+        return _boards.get(session_id)
+
+
+def final_board(session) -> FinalBoard:
+    """The ended session's FinalBoard, rebuilt from LiveLeaderboard rows if this process lacks it."""
+    board = peek_board(session.pk)
+    if board is None:
+        ensure_final(session)
+        board = peek_board(session.pk)
+    if board is None:
+        board = FinalBoard.build(
+            (rank, uid, score)
+            for uid, rank, score in LiveLeaderboard.objects.filter(livesession=session)
+            .order_by("rank", "participant__user_id")
+            .values_list("participant__user_id", "rank", "score")
+        )
+        _remember(session.pk, board)
+    return board
+
+
+def full_rows(session) -> list[dict]:
+    """Every final row with names (the host's on-demand board)."""
+    ensure_final(session)
+    return list(
+        LiveLeaderboard.objects.filter(livesession=session)
+        .order_by("rank", "participant__user__username")
+        .values(
+            "rank", "score",
+            user_id=F("participant__user_id"),
+            username=F("participant__user__username"),
+            first_name=F("participant__user__first_name"),
+            last_name=F("participant__user__last_name"),
+        )
+    )
@@ -0,0 +1,70 @@
+"""
+Legacy answers: LiveParticipant.answer_questions JSON -> LiveAnswer rows.
+
+Sessions that ran before answers moved to LiveAnswer keep them only in the
+participant's JSON list. `manage.py migrate_live_answers` copies them all in
+bulk; until it has run, code that aggregates LiveAnswer for an ended session
+(leaderboard.ensure_final, reports.answers_report) calls copy_session() first,
+so a legacy session is never scored or reported as all-skipped.
+
+Copying is idempotent: (participant, question_index) is unique, rows are
+inserted with ignore_conflicts, and the first answer per question wins, as in
+the old duplicate check.
+"""
+from __future__ import annotations
+
+from .models import LiveAnswer, LiveParticipant
+
+BATCH_SIZE = 1000
+
+
+def parse(answer):
+    """(question_index, selected, points) from one legacy JSON answer, or None."""
+    try:
+        idx = int(answer.get("question_id"))
+        points = int(answer.get("points", 0))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if idx < 0:
+        return None
+    selected = []
+    for raw in answer.get("selected") or []:
+        try:
+            selected.append(int(raw))
+        except (TypeError, ValueError):
+            continue
+    return idx, selected, points
+
+
+def answers_for(participant) -> list[LiveAnswer]:
+    """Unsaved LiveAnswer rows for a participant's legacy answers."""
+    rows, seen = [], set()
+    for a in participant.answer_questions or []:
+        parsed = parse(a)
+        if parsed is None or parsed[0] in seen:
+            continue
+        idx, selected, points = parsed
+        seen.add(idx)
+        rows.append(LiveAnswer(
+            livesession_id=participant.livesession_id,
+            participant_id=participant.id,
+            question_index=idx,
+            selected=selected,
+            points=points,
+        ))
+    return rows
+
+
+def legacy_participants():
+    """Participants that still carry JSON answers."""
+    return LiveParticipant.objects.exclude(answer_questions=[]).only("id", "livesession_id", "answer_questions")
+
+
+def copy_session(session_id: int) -> int:
+    """Copy one session's legacy answers into LiveAnswer; returns the rows offered (0 for new sessions)."""
+    rows = []
+    for p in legacy_participants().filter(livesession_id=session_id):
+        rows.extend(answers_for(p))
+    if rows:
+        LiveAnswer.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return len(rows)
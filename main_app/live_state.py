@@ -0,0 +1,619 @@
+"""
+Authoritative in-process state for live sessions.
+
+Every live session that is being hosted gets exactly one LiveState object per
+process, shared by all consumers and views. Host actions mutate it in O(1) and
+mark it dirty; dirty sessions are written back to the DB in batches by a
+background flusher (write-behind), so a "next" click no longer waits on a
+read-modify-write of LiveSession.details before anyone sees the new question.
+
+The lobby is persisted as LiveLobbyEntry rows rather than a list inside
+details: joins and admits become single-row inserts/deletes guarded by a
+unique constraint, so concurrent joins cannot overwrite each other.
+
+Answers go through the same flusher: they are de-duplicated against an
+in-memory set, acknowledged immediately and bulk-inserted as LiveAnswer rows,
+so DB round trips per question grow with batches rather than with students.
+
+Sync callers (HTTP views, DB threads) have no running event loop, so their
+changes are persisted immediately instead.
+
+With several worker processes each holds its own LiveState, so the session
+row carries a state_version. The flusher writes the row only if the version
+is the one its state was loaded or last written at. On a clash it merges the
+newer row in (a session only moves forward: started/ended once either side
+did, the further question) and writes the merge, so one process's
+advance or end is never undone by another's stale snapshot. get_state()
+merges rows written elsewhere the same way. A join made through another
+process only reaches this state's lobby as a LiveLobbyEntry row, so the lobby
+is re-read (sync_lobby) before it is acted on: when the session starts and when
+the host admits someone this state has not seen join.
+
+States are changed under _lock (state.lock), which the flusher also holds
+while it snapshots them. States unused for IDLE_TTL are dropped.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+
+from . import stats
+from .leaderboard import Ranking, load_scores
+from .models import LiveSession, LiveParticipant, LiveAnswer, LiveLobbyEntry, LiveJoinCode
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.05        # seconds between write-behind passes
+FLUSH_BATCH_SIZE = 200       # rows per bulk statement
+ANSWER_BATCH_SIZE = 500      # queued answers that trigger an early flush
+MAX_PENDING_ANSWERS = 5000   # above this, submitters wait for a flush (back-pressure)
+FLUSH_RETRY_DELAY = 1.0      # seconds the flusher waits after a failed pass
+WRITE_ATTEMPTS = 5           # conditional session-row writes before a flush pass gives up
+IDLE_TTL = 2 * 60 * 60       # seconds unused before a clean state is dropped
+
+_lock = threading.RLock()
+_flush_lock = threading.Lock()  # one flush at a time, so a finished flush_now() means committed
+_states: dict[int, "LiveState"] = {}
+_dirty: set[int] = set()
+_answers: dict[int, list] = {}  # session_id -> [(user_id, idx, selected, points), ...]
+_pending_answers = 0
+_flusher: asyncio.Task | None = None
+_wake: asyncio.Event | None = None
+
+
+class LiveState:
+    """Mutable snapshot of one live session (index, lobby, participants, timestamps)."""
+
+    __slots__ = (
+        "session_id", "host_id", "current_index", "total", "lobby", "participants",
+        "participant_pks", "answered", "ranking", "started_at", "ended_at", "extra",
+        "roster_seq", "version", "last_used", "_new_participants", "_lobby_added", "_lobby_removed",
+        "_session_dirty", "_extra_dirty",
+    )
+
+    def __init__(self, session: LiveSession, scores=None, lobby=()):
+        d = dict(session.details or {})
+        self.session_id = session.pk
+        self.host_id = session.host_id
+        self.current_index = int(d.pop("current_index", -1))
+        self.total = int(d.pop("total_questions", 0))
+        # dict keeps join order and gives O(1) add/remove
+        self.lobby = dict.fromkeys(lobby)
+        self.participants = set(scores or ())
+        self.participant_pks: dict[int, int] = {}     # user_id -> LiveParticipant.pk, filled lazily
+        self.answered: set[tuple[int, int]] = set()   # (user_id, question_index) already accepted
+        self.ranking = Ranking(scores)
+        self.started_at = session.started_at
+        self.ended_at = session.ended_at
+        self.extra = d  # join_code and any other keys we do not own
+        self.roster_seq = 0  # bumped per lobby/participant delta (see roster.py)
+        self.version = session.state_version  # of the row this state last read or wrote
+        self.last_used = time.monotonic()
+        self._new_participants: set[int] = set()
+        self._lobby_added: set[int] = set()
+        self._lobby_removed: set[int] = set()
+        self._session_dirty = False
+        self._extra_dirty = False  # join code changed here and not yet written
+        # Sessions created before the lobby table kept it in details; move it over
+        legacy = d.pop("lobby", None)
+        if legacy is not None:
+            self._session_dirty = True
+            for uid in legacy:
+                self.add_to_lobby(uid)
+
+    # ----- reads -----
+    @property
+    def lock(self):
+        """The registry lock; hold it to read or change several fields as one step."""
+        return _lock
+
+    @property
+    def started(self) -> bool:
+        return self.started_at is not None
+
+    @property
+    def ended(self) -> bool:
+        return self.ended_at is not None
+
+    @property
+    def join_code(self) -> str:
+        return self.extra.get("join_code", "")
+
+    def idx_and_total(self):
+        with _lock:
+            return self.current_index, self.total
+
+    def details(self) -> dict:
+        return {
+            **self.extra,
+            "current_index": self.current_index,
+            "total_questions": self.total,
+        }
+
+    # ----- mutations (call touch() afterwards) -----
+    def add_to_lobby(self, user_id: int) -> bool:
+        with _lock:
+            if user_id in self.lobby or user_id in self.participants:
+                return False
+            self.lobby[user_id] = None
+            self._lobby_added.add(user_id)
+            self._lobby_removed.discard(user_id)
+            return True
+
+    def admit(self, user_id: int) -> bool:
+        with _lock:
+            if user_id in self.lobby:
+                del self.lobby[user_id]
+                self._lobby_removed.add(user_id)
+                self._lobby_added.discard(user_id)
+            if user_id in self.participants:
+                return False
+            self.participants.add(user_id)
+            self._new_participants.add(user_id)
+            self.ranking.add(user_id, 0)
+            return True
+
+    def merge_lobby(self, user_ids) -> tuple[list, list]:
+        """
+        Line the lobby up with the stored LiveLobbyEntry user ids (join order):
+        add joins made through other processes, drop users they admitted.
+        Changes of ours not flushed yet win. Returns (added, removed).
+        """
+        with _lock:
+            stored = dict.fromkeys(user_ids)
+            removed = [uid for uid in self.lobby if uid not in stored and uid not in self._lobby_added]
+            added = [
+                uid for uid in stored
+                if uid not in self.lobby and uid not in self.participants and uid not in self._lobby_removed
+            ]
+            for uid in removed:
+                del self.lobby[uid]
+            for uid in added:
+                self.lobby[uid] = None
+            return added, removed
+
+    def record_answer(self, user_id: int, points: int) -> int:
+        """Credit an already-persisted answer; returns the user's new total."""
+        with _lock:
+            self.participants.add(user_id)
+        return self.ranking.add(user_id, points)
+
+    def start(self, total: int) -> bool:
+        with _lock:
+            if self.started_at:
+                return False
+            self.started_at = timezone.now()
+            for uid in list(self.lobby):
+                self.admit(uid)
+            self.current_index = 0 if total else -1
+            self.total = total
+            self._session_dirty = True
+            return True
+
+    def advance(self) -> bool:
+        """Move to the next question; False when there is none left."""
+        with _lock:
+            if 0 <= self.current_index < self.total - 1:
+                self.current_index += 1
+                self._session_dirty = True
+                return True
+            return False
+
+    def end(self) -> bool:
+        with _lock:
+            if self.ended_at:
+                return False
+            self.ended_at = timezone.now()
+            self._session_dirty = True
+            return True
+
+    def merge(self, session: LiveSession, extra_changed: bool = False):
+        """
+        Fold in a session row another process wrote (its state_version moved on).
+
+        Keeps the later of each field, so neither side's transitions are lost.
+        The row's join code wins unless ours changed and is not written yet.
+        """
+        d = dict(session.details or {})
+        idx = int(d.pop("current_index", -1))
+        total = int(d.pop("total_questions", 0))
+        d.pop("lobby", None)
+        with _lock:
+            if session.state_version <= self.version:
+                return
+            self.version = session.state_version
+            if session.started_at and (not self.started_at or session.started_at < self.started_at):
+                self.started_at = session.started_at
+            self.ended_at = self.ended_at or session.ended_at
+            self.total = max(self.total, total)
+            self.current_index = max(self.current_index, idx)
+            if not (extra_changed or self._extra_dirty):
+                self.extra = d
+            else:
+                self.extra = {**d, **self.extra}
+
+    def apply_to(self, session: LiveSession):
+        """Overlay this state onto a (possibly stale) model instance for rendering."""
+        session.started_at = self.started_at
+        session.ended_at = self.ended_at
+        session.details = self.details()
+        return session
+
+    def set_join_code(self, code: str):
+        with _lock:
+            self.extra["join_code"] = code
+            self._session_dirty = True
+            self._extra_dirty = True
+
+    def _take_snapshot(self):
+        """Pending writes as a Snapshot, resetting them; details is None if the row is clean."""
+        snap = Snapshot(
+            self.session_id,
+            self.details() if self._session_dirty else None,
+            self.started_at,
+            self.ended_at,
+            self._new_participants,
+            self._lobby_added,
+            self._lobby_removed,
+            self.version,
+            self._extra_dirty,
+        )
+        self._session_dirty = self._extra_dirty = False
+        self._new_participants, self._lobby_added, self._lobby_removed = set(), set(), set()
+        return snap
+
+    def _restore(self, snap: "Snapshot"):
+        """Re-mark a snapshot's writes as pending after a failed flush."""
+        if snap.details is not None:
+            self._session_dirty = True
+            self._extra_dirty |= snap.extra_changed
+        self._new_participants |= snap.new_participants
+        # anything changed since the snapshot wins over the failed write
+        self._lobby_added |= snap.lobby_added - self._lobby_removed
+        self._lobby_removed |= snap.lobby_removed - self._lobby_added
+
+
+class Snapshot(NamedTuple):
+    session_id: int
+    details: dict | None
+    started_at: object
+    ended_at: object
+    new_participants: set
+    lobby_added: set
+    lobby_removed: set
+    version: int          # state_version the details were based on
+    extra_changed: bool   # details carry a join code change of ours
+
+
+# ----------------------- Registry -----------------------
+
+def get_state(session: LiveSession) -> LiveState:
+    """
+    Return the shared state for a session, loading it on first use (sync only).
+
+    A held state is merged with the given (freshly loaded) row if another
+    process has written the session since.
+    """
+    now = time.monotonic()
+    with _lock:
+        state = _states.get(session.pk)
+        if state is not None:
+            state.last_used = now
+    if state is not None:
+        state.merge(session)
+        return state
+    if session.ended_at:
+        # Ended sessions are read-only: no scores to load, nothing to keep around
+        return LiveState(session)
+    lobby = LiveLobbyEntry.objects.filter(livesession_id=session.pk).values_list("user_id", flat=True)
+    fresh = LiveState(session, load_scores(session.pk), lobby)
+    fresh.participant_pks = dict(
+        LiveParticipant.objects.filter(livesession_id=session.pk).values_list("user_id", "id")
+    )
+    fresh.answered = set(
+        LiveAnswer.objects.filter(livesession_id=session.pk).values_list("participant__user_id", "question_index")
+    )
+    with _lock:
+        _evict_idle(now)
+        return _states.setdefault(session.pk, fresh)
+
+
+def _evict_idle(now: float):
+    """Drop states unused for IDLE_TTL with nothing left to flush (caller holds _lock)."""
+    for sid in [
+        sid for sid, st in _states.items()
+        if now - st.last_used >= IDLE_TTL and sid not in _dirty and sid not in _answers
+    ]:
+        del _states[sid]
+
+
+def peek(session_id: int) -> LiveState | None:
+    with _lock:
+        return _states.get(session_id)
+
+
+def discard(session_id: int):
+    """Drop a session from memory once its final state has been flushed."""
+    with _lock:
+        if session_id not in _dirty and session_id not in _answers:
+            _states.pop(session_id, None)
+
+
+def _schedule(session_id: int, urgent: bool = False):
+    """Start (or wake) the background flusher; without a running loop, flush now."""
+    global _flusher, _wake
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        flush_now([session_id])
+        return
+    with _lock:
+        if _flusher is None or _flusher.done():
+            _wake = asyncio.Event()
+            _flusher = loop.create_task(_flush_loop(_wake))
+        if urgent:
+            _wake.set()
+
+
+def sync_lobby(state: LiveState) -> tuple[list, list]:
+    """Re-read the session's stored lobby into state (sync only); see LiveState.merge_lobby."""
+    # a flush in progress has taken our pending lobby changes but not committed them yet
+    with _flush_lock:
+        stored = list(
+            LiveLobbyEntry.objects.filter(livesession_id=state.session_id).values_list("user_id", flat=True)
+        )
+        return state.merge_lobby(stored)
+
+
+def touch(state: LiveState):
+    """Mark state dirty; flush in the background if a loop is running, else now."""
+    with _lock:
+        _dirty.add(state.session_id)
+        state.last_used = time.monotonic()
+    _schedule(state.session_id)
+
+
+def queue_answer(state: LiveState, user_id: int, idx: int, selected, points: int) -> bool:
+    """
+    Accept an answer into the write-behind queue; False if it is a duplicate.
+
+    Duplicates are rejected from the in-memory answered set, so the caller can
+    acknowledge straight away. A full batch wakes the flusher early.
+    """
+    global _pending_answers
+    with _lock:
+        key = (user_id, idx)
+        if key in state.answered:
+            return False
+        state.answered.add(key)
+        _answers.setdefault(state.session_id, []).append((user_id, idx, list(selected), points))
+        _pending_answers += 1
+        urgent = _pending_answers >= ANSWER_BATCH_SIZE
+        state.last_used = time.monotonic()
+    state.record_answer(user_id, points)
+    _schedule(state.session_id, urgent=urgent)
+    return True
+
+
+def pending_answers() -> int:
+    return _pending_answers
+
+
+async def _flush_loop(wake: asyncio.Event):
+    global _flusher
+    while True:
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
+        with _lock:
+            if not _dirty and not _answers:
+                _flusher = None
+                return
+        try:
+            await database_sync_to_async(flush_now)()
+        except Exception:
+            # flush_now put everything back; keep the loop alive and retry
+            logger.exception("Live state flush failed; retrying in %ss", FLUSH_RETRY_DELAY)
+            await asyncio.sleep(FLUSH_RETRY_DELAY)
+
+
+def flush_now(session_ids=None) -> int:
+    """
+    Persist dirty sessions and queued answers (all, or the given sessions'),
+    in one transaction with a savepoint per session: a session whose rows
+    violate a constraint has this pass's writes logged and dropped rather
+    than failing every session's flush. Returns the number of sessions touched.
+
+    Waits for a flush already in progress, so once this returns everything
+    queued before the call is in the DB (the end-of-session board relies on it).
+    """
+    with _flush_lock:
+        return _flush(session_ids)
+
+
+def _flush(session_ids) -> int:
+    global _pending_answers
+    with _lock:
+        if session_ids is None:
+            ids, answer_ids = set(_dirty), list(_answers)
+        else:
+            ids = _dirty.intersection(session_ids)
+            answer_ids = [i for i in set(session_ids) if i in _answers]
+        snaps = [_states[i]._take_snapshot() for i in ids if i in _states]
+        _dirty.difference_update(ids)
+        answers = {sid: _answers.pop(sid) for sid in answer_ids}
+        _pending_answers -= sum(len(v) for v in answers.values())
+    if not snaps and not answers:
+        return 0
+
+    by_id = {s.session_id: s for s in snaps}
+    session_ids = sorted(set(by_id) | set(answers))
+    # FKs are checked at commit, so a row for a deleted session or user would
+    # fail the whole flush there; filter those out up front
+    live = set(LiveSession.objects.filter(pk__in=session_ids).values_list("pk", flat=True))
+    user_ids = {uid for s in snaps for uid in s.new_participants | s.lobby_added}
+    user_ids.update(uid for rows in answers.values() for uid, *_ in rows)
+    users = set(User.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+    dropped, ended_ids = set(), []
+    try:
+        with transaction.atomic():
+            for sid in session_ids:
+                if sid not in live:
+                    logger.warning("Dropping writes for deleted live session %s", sid)
+                    dropped.add(sid)
+                    continue
+                # one savepoint per session: a bad row loses that session's batch, not everyone's
+                try:
+                    with transaction.atomic():
+                        if _write_one(sid, by_id.get(sid), answers.get(sid, []), users):
+                            ended_ids.append(sid)
+                except (IntegrityError, DataError):
+                    logger.exception("Dropping this flush's writes for live session %s", sid)
+                    dropped.add(sid)
+                    with _lock:
+                        if sid in _states:
+                            _states[sid].participant_pks.clear()  # may hold rolled-back ids
+            if ended_ids:
+                # update() sends no signals; ongoing-session counts changed
+                transaction.on_commit(stats.invalidate)
+    except Exception:
+        # Put everything back so the next pass retries it
+        with _lock:
+            for s in snaps:
+                if s.session_id in dropped:
+                    continue
+                _dirty.add(s.session_id)
+                if s.session_id in _states:
+                    _states[s.session_id]._restore(s)
+            for sid, rows in answers.items():
+                if sid in dropped:
+                    continue
+                _answers.setdefault(sid, [])[:0] = rows
+                _pending_answers += len(rows)
+        raise
+    return len(session_ids)
+
+
+def _write_one(session_id: int, s: Snapshot | None, answers: list, users: set) -> bool:
+    """One session's share of a flush; True if its row was written ended."""
+    unknown = {uid for uid, *_ in answers} - users
+    if s is not None:
+        unknown |= (s.new_participants | s.lobby_added) - users
+    if unknown:
+        logger.warning("Live session %s: skipping rows for unknown users %s", session_id, sorted(unknown))
+
+    ended = False
+    if s is not None:
+        ended = s.details is not None and _write_session(s)
+        if ended:
+            # release the code so new sessions can reuse it
+            LiveJoinCode.objects.filter(livesession_id=session_id).delete()
+        lobby_rows = [LiveLobbyEntry(livesession_id=session_id, user_id=uid) for uid in s.lobby_added - unknown]
+        if lobby_rows:
+            # (livesession, user) is unique, so a repeated join is a no-op
+            LiveLobbyEntry.objects.bulk_create(lobby_rows, batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True)
+        if s.lobby_removed:
+            LiveLobbyEntry.objects.filter(livesession_id=session_id, user_id__in=s.lobby_removed).delete()
+        participants = [
+            LiveParticipant(livesession_id=session_id, user_id=uid) for uid in s.new_participants - unknown
+        ]
+        if participants:
+            LiveParticipant.objects.bulk_create(participants, batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True)
+    answers = [a for a in answers if a[0] not in unknown]
+    if answers:
+        _insert_answers({session_id: answers})
+    return ended
+
+
+def _write_session(s: Snapshot) -> bool:
+    """
+    Write a snapshot's session row if its state_version is unchanged; on a
+    clash merge the newer row into the state and write that. True if the
+    written row is ended.
+    """
+    state = _states.get(s.session_id)
+    version, extra_changed = s.version, s.extra_changed
+    fields = {"details": s.details, "started_at": s.started_at, "ended_at": s.ended_at}
+    for _ in range(WRITE_ATTEMPTS):
+        written = LiveSession.objects.filter(pk=s.session_id, state_version=version).update(
+            state_version=version + 1, **fields
+        )
+        if written:
+            if state is not None:
+                with _lock:
+                    state.version = max(state.version, version + 1)
+            return fields["ended_at"] is not None
+        row = (
+            LiveSession.objects.filter(pk=s.session_id)
+            .only("details", "started_at", "ended_at", "state_version")
+            .first()
+        )
+        if row is None or state is None:
+            return False  # session deleted, or no longer held here
+        state.merge(row, extra_changed)
+        with _lock:
+            version = state.version
+            fields = {"details": state.details(), "started_at": state.started_at, "ended_at": state.ended_at}
+    raise RuntimeError(f"Live session {s.session_id} kept changing during the flush")
+
+
+def _insert_answers(answers: dict[int, list]):
+    """
+    Bulk-insert queued answers, creating any participant rows they need.
+
+    An answer another process already stored for the same question is
+    dropped, and its points come back off this process's live board once
+    the flush commits.
+    """
+    rows, debits = [], []
+    for sid, queued in answers.items():
+        state = _states.get(sid)
+        pks = state.participant_pks if state is not None else {}
+        missing = {uid for uid, *_ in queued if uid not in pks}
+        if missing:
+            LiveParticipant.objects.bulk_create(
+                [LiveParticipant(livesession_id=sid, user_id=uid) for uid in missing],
+                batch_size=FLUSH_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            pks.update(
+                LiveParticipant.objects.filter(livesession_id=sid, user_id__in=missing).values_list("user_id", "id")
+            )
+        stored = set(
+            LiveAnswer.objects.filter(
+                livesession_id=sid,
+                participant_id__in={pks[uid] for uid, *_ in queued},
+                question_index__in={idx for _, idx, *_ in queued},
+            ).values_list("participant_id", "question_index")
+        )
+        for uid, idx, selected, points in queued:
+            if (pks[uid], idx) in stored:
+                if state is not None and points:
+                    debits.append((state, uid, points))
+                continue
+            rows.append(LiveAnswer(
+                livesession_id=sid,
+                participant_id=pks[uid],
+                question_index=idx,
+                selected=selected,
+                points=points,
+            ))
+    # the (participant, question_index) constraint still guards cross-process races
+    LiveAnswer.objects.bulk_create(rows, batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True)
+    if debits:
+        transaction.on_commit(lambda: [state.ranking.add(uid, -points) for state, uid, points in debits])
+
+
+async def flush(session_ids=None) -> int:
+    return await database_sync_to_async(flush_now)(session_ids)
@@ -90,7 +90,6 @@ class Command(BaseCommand):
             defaults={
                 "join_code": _short_code()[:8],
                 "subject_category": _subject_default(),
-                "enrolled_students": [],
             },
         )
 
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main_app.models import Course, CourseEnrollment
+
+
+class Command(BaseCommand):
+    help = "Copies legacy Course.enrolled_students JSON into CourseEnrollment rows (safe to re-run)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Empty enrolled_students on each course once its enrollments are copied.",
+        )
+
+    def handle(self, *args, **opts):
+        batch_size = opts["batch_size"]
+        qs = Course.objects.exclude(enrolled_students=[]).only("id", "enrolled_students").order_by("id")
+        courses = copied = 0
+        batch, done_ids = [], []
+
+        def flush():
+            nonlocal copied
+            # skip ids of deleted accounts
+            live = set(
+                get_user_model().objects.filter(id__in={e.user_id for e in batch}).values_list("id", flat=True)
+            )
+            rows = [e for e in batch if e.user_id in live]
+            with transaction.atomic():
+                # unique (course, user) makes re-runs a no-op
+                CourseEnrollment.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+                if opts["clear"]:
+                    Course.objects.filter(id__in=done_ids).update(enrolled_students=[])
+            copied += len(rows)
+            batch.clear()
+            done_ids.clear()
+
+        for c in qs.iterator(chunk_size=batch_size):
+            courses += 1
+            for raw in set(c.enrolled_students or []):
+                try:
+                    uid = int(raw)
+                except (TypeError, ValueError):
+                    continue
+                batch.append(CourseEnrollment(course_id=c.id, user_id=uid))
+            done_ids.append(c.id)
+            if len(batch) >= batch_size:
+                flush()
+        if batch or done_ids:
+            flush()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {courses} courses, offered {copied} enrollments to CourseEnrollment."
+        ))
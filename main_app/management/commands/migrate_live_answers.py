@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main_app import legacy_answers
+from main_app.models import LiveParticipant, LiveAnswer
+
+
+class Command(BaseCommand):
+    help = "Copies legacy LiveParticipant.answer_questions JSON into LiveAnswer rows (safe to re-run)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Empty answer_questions on each participant once its answers are copied.",
+        )
+
+    def handle(self, *args, **opts):
+        batch_size = opts["batch_size"]
+        qs = legacy_answers.legacy_participants().order_by("id")
+        participants = copied = 0
+        batch, done_ids = [], []
+
+        def flush():
+            nonlocal copied
+            with transaction.atomic():
+                # unique (participant, question_index) makes re-runs a no-op
+                LiveAnswer.objects.bulk_create(batch, batch_size=batch_size, ignore_conflicts=True)
+                if opts["clear"]:
+                    LiveParticipant.objects.filter(id__in=done_ids).update(answer_questions=[])
+            copied += len(batch)
+            batch.clear()
+            done_ids.clear()
+
+        for p in qs.iterator(chunk_size=batch_size):
+            participants += 1
+            batch.extend(legacy_answers.answers_for(p))
+            done_ids.append(p.id)
+            if len(batch) >= batch_size:
+                flush()
+        if batch or done_ids:
+            flush()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {participants} participants, offered {copied} answers to LiveAnswer."
+        ))
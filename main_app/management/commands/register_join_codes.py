@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from main_app.models import LiveSession, LiveJoinCode
+
+
+class Command(BaseCommand):
+    help = (
+        "Registers the join codes of sessions that have not ended in LiveJoinCode "
+        "(safe to re-run). Sessions whose code clashes with another live session get a new one."
+    )
+
+    def handle(self, *args, **opts):
+        qs = (
+            LiveSession.objects.filter(ended_at__isnull=True, join_code_entry__isnull=True)
+            .only("id", "details")
+            .order_by("id")
+        )
+        registered = reassigned = 0
+        for session in qs.iterator():
+            code = (session.details or {}).get("join_code") or ""
+            if code:
+                try:
+                    with transaction.atomic():
+                        LiveJoinCode.objects.create(livesession=session, code=code.upper())
+                    registered += 1
+                    continue
+                except IntegrityError:
+                    pass
+            session.regenerate_join_code()
+            reassigned += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Registered {registered} join codes, issued {reassigned} new ones."
+        ))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from main_app import jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs (session finalisation, exports); run one or more alongside the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due instead of waiting.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--max-jobs", type=int, default=0, help="Exit after this many jobs (0: no limit).")
+
+    def handle(self, *args, **opts):
+        worker = jobs.worker_name()
+        done = failed = 0
+        last_sweep = 0.0
+        self.stdout.write(f"Worker {worker} waiting for jobs.")
+        try:
+            while not opts["max_jobs"] or done + failed < opts["max_jobs"]:
+                close_old_connections()  # long-running process: drop broken/expired connections
+                if time.monotonic() - last_sweep >= jobs.STALE_AFTER / 2:
+                    if requeued := jobs.requeue_stale():
+                        self.stdout.write(f"Requeued {requeued} stale jobs.")
+                    last_sweep = time.monotonic()
+                job = jobs.claim(worker)
+                if job is None:
+                    if opts["once"]:
+                        break
+                    time.sleep(opts["sleep"])
+                    continue
+                if jobs.run(job):
+                    done += 1
+                else:
+                    failed += 1
+                    self.stderr.write(f"Job {job.pk} ({job.kind}) failed on attempt {job.attempts}.")
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker} ran {done} jobs, {failed} failed."))
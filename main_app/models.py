@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
+from django.utils import timezone
 from .constants import ROLE_CHOICES, DEFAULT_ROLE, SUBJECT_CATEGORIES
+from . import answer_key
 import secrets
 import string
 
@@ -66,6 +68,8 @@ class Course(models.Model):
     course_name = models.CharField(max_length=255)
     join_code = models.CharField(max_length=32, unique=True)
     subject_category = models.CharField(max_length=32, choices=SUBJECT_CATEGORIES)
+    # Legacy list of user ids; enrollment now lives in CourseEnrollment.
+    # Kept until `manage.py migrate_enrollments` has copied existing data over.
     enrolled_students = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -81,6 +85,22 @@ class Course(models.Model):
         return f"{self.course_name} ({self.organization.name})"
 
 
+class CourseEnrollment(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="enrollments")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="course_enrollments")
+    enrolled_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("course", "user")
+        indexes = [
+            models.Index(fields=["user", "course"]),
+        ]
+        ordering = ["course_id", "user_id"]
+
+    def __str__(self) -> str:
+        return f"{self.user} in {self.course}"
+
+
 def default_quiz_content():
     return []
 
@@ -89,6 +109,8 @@ class Quiz(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="quizzes")
     quiz_title = models.CharField(max_length=255)
     content = models.JSONField(default=default_quiz_content, blank=True)
+    # Bumped whenever content is saved; compiled answer keys are tagged with it
+    content_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -101,6 +123,15 @@ class Quiz(models.Model):
     def __str__(self) -> str:
         return f"{self.quiz_title} — {self.course.course_name}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if self.pk and (update_fields is None or "content" in update_fields):
+            self.content_version += 1
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "content_version"}
+            answer_key.invalidate(self.pk)
+        super().save(*args, **kwargs)
+
 
 def _short_code(length=6):
     alphabet = string.ascii_uppercase + string.digits
@@ -108,7 +139,8 @@ def _short_code(length=6):
 
 
 def default_session_details():
-    return {"join_code": _short_code(), "lobby": []}
+    # join codes are handed out by LiveJoinCode.assign (see regenerate_join_code)
+    return {}
 
 
 def default_answers():
@@ -120,7 +152,12 @@ class LiveSession(models.Model):
     host = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name="hosted_sessions")
     started_at = models.DateTimeField(null=True, blank=True)
     ended_at = models.DateTimeField(null=True, blank=True)
+    # Set once the final LiveLeaderboard rows are written; later reads never recompute
+    leaderboard_finalised_at = models.DateTimeField(null=True, blank=True)
     details = models.JSONField(default=default_session_details, blank=True)
+    # Bumped by every write of details/started_at/ended_at; live_state writes only
+    # if it is unchanged, so processes cannot overwrite each other's transitions
+    state_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -141,10 +178,54 @@ class LiveSession(models.Model):
 
     def regenerate_join_code(self, length=6, save=True):
         d = dict(self.details or {})
-        d["join_code"] = _short_code(length)
+        d["join_code"] = LiveJoinCode.assign(self, length)
         self.details = d
         if save:
-            self.save(update_fields=["details"])
+            LiveSession.objects.filter(pk=self.pk).update(details=d, state_version=models.F("state_version") + 1)
+            self.refresh_from_db(fields=["state_version"])
+
+
+class LiveJoinCode(models.Model):
+    """
+    Join codes of sessions that have not ended.
+
+    The unique code column keeps codes distinct among live sessions and makes
+    resolving one an index lookup; the row is deleted when the session ends,
+    which releases the code.
+    """
+    code = models.CharField(max_length=32, unique=True)
+    livesession = models.OneToOneField(LiveSession, on_delete=models.CASCADE, related_name="join_code_entry")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.code} → session {self.livesession_id}"
+
+    @classmethod
+    def assign(cls, session, length=6, attempts=10) -> str:
+        """Register a fresh code for the session (replacing any previous one) and return it."""
+        for attempt in range(attempts):
+            # every few collisions, widen the code space
+            code = _short_code(length + attempt // 4)
+            try:
+                with transaction.atomic():
+                    cls.objects.update_or_create(livesession=session, defaults={"code": code})
+            except IntegrityError:
+                continue
+            return code
+        raise RuntimeError("Could not allocate a unique join code")
+
+    @classmethod
+    def resolve(cls, code: str):
+        """The live session holding this code, or None."""
+        entry = (
+            cls.objects.select_related(
+                "livesession", "livesession__quiz", "livesession__quiz__course",
+                "livesession__quiz__course__organization",
+            )
+            .filter(code=code)
+            .first()
+        )
+        return entry.livesession if entry else None
 
 
 class LiveParticipant(models.Model):
@@ -152,6 +233,9 @@ class LiveParticipant(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="live_participations")
     joined_at = models.DateTimeField(auto_now_add=True)
     left_at = models.DateTimeField(null=True, blank=True)
+    # Legacy per-participant answer list; answers now live in LiveAnswer.
+    # Kept until `manage.py migrate_live_answers` has copied existing data over
+    # (until then readers copy a session's answers on demand, see legacy_answers).
     answer_questions = models.JSONField(default=default_answers, blank=True)
 
     class Meta:
@@ -166,6 +250,39 @@ class LiveParticipant(models.Model):
         return f"{self.user} in session {self.livesession_id}"
 
 
+class LiveLobbyEntry(models.Model):
+    """A student waiting to be admitted; one row per (session, user), removed on admit."""
+    livesession = models.ForeignKey(LiveSession, on_delete=models.CASCADE, related_name="lobby_entries")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="live_lobby_entries")
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("livesession", "user")
+        ordering = ["livesession_id", "joined_at", "id"]
+
+    def __str__(self) -> str:
+        return f"{self.user} waiting in session {self.livesession_id}"
+
+
+class LiveAnswer(models.Model):
+    livesession = models.ForeignKey(LiveSession, on_delete=models.CASCADE, related_name="answers")
+    participant = models.ForeignKey(LiveParticipant, on_delete=models.CASCADE, related_name="answers")
+    question_index = models.PositiveIntegerField()
+    selected = models.JSONField(default=list, blank=True)
+    points = models.IntegerField(default=0)
+    answered_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("participant", "question_index")
+        indexes = [
+            models.Index(fields=["livesession", "question_index"]),
+        ]
+        ordering = ["livesession_id", "question_index", "participant_id"]
+
+    def __str__(self) -> str:
+        return f"Q{self.question_index + 1} — {self.participant} ({self.points} pts)"
+
+
 class LiveLeaderboard(models.Model):
     livesession = models.ForeignKey(LiveSession, on_delete=models.CASCADE, related_name="leaderboard_entries")
     participant = models.OneToOneField(LiveParticipant, on_delete=models.CASCADE, related_name="leaderboard_row")
@@ -182,3 +299,64 @@ class LiveLeaderboard(models.Model):
 
     def __str__(self) -> str:
         return f"Rank {self.rank} — {self.participant}"
+
+
+class LiveSessionReport(models.Model):
+    """
+    Per-question answers report of an ended session, built once and kept as-is.
+
+    An ended session's answers never change, so the report is computed in one
+    pass on first request and stored here; later views read this row (or the
+    cache in front of it) instead of rebuilding. format_version lets a new
+    report layout rebuild stale rows.
+    """
+    livesession = models.OneToOneField(LiveSession, on_delete=models.CASCADE, related_name="answers_report")
+    format_version = models.PositiveSmallIntegerField(default=1)
+    data = models.JSONField(default=dict)
+    built_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"Answers report — session {self.livesession_id}"
+
+
+class Job(models.Model):
+    """
+    One piece of background work for the run_jobs worker (see main_app/jobs.py).
+
+    The table is the queue: workers claim the oldest queued row whose run_after
+    has passed with a conditional UPDATE, so any number of workers can share it
+    without a broker. progress/message are written as the job runs, for polling.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)  # percent
+    message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    # Refreshed on every progress report; a running job that stops beating is requeued
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="jobs"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["status", "run_after"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"Job #{self.pk} — {self.kind} ({self.status})"
@@ -0,0 +1,156 @@
+"""
+In-process index of live sessions that have not ended, feeding dashboards.
+
+The index is loaded with one query on first use. After that, the create,
+start and end hooks keep it current and publish the same change to the
+org's feed group (and the global one for superusers). Dashboards therefore
+receive deltas over OngoingSessionsConsumer instead of re-querying
+LiveSession.objects.filter(ended_at__isnull=True) on every load.
+
+With several worker processes the hooks only run in the process that made
+the change. Feed consumers apply the deltas they receive (receive()), and the
+index is reloaded once it is INDEX_TTL old, so processes without feed sockets
+catch up too.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import NamedTuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .constants import ROLE_TEACHER, ROLE_STUDENT
+from .models import LiveSession, CourseEnrollment
+from .permissions import memberships
+
+GLOBAL_GROUP = "ongoing_all"
+INDEX_TTL = 30  # seconds before the index is reloaded (picks up other processes' changes)
+
+_lock = threading.Lock()
+_index: dict[int, dict] | None = None
+_loaded_at = 0.0
+
+
+def org_group(org_id: int) -> str:
+    return f"ongoing_org_{org_id}"
+
+
+class FeedScope(NamedTuple):
+    """Which ongoing sessions a user's dashboard shows (mirrors the dashboard roles)."""
+    group: str
+    org_id: int | None                 # None: every org (superuser)
+    host_id: int | None = None         # teachers: only sessions they host
+    course_ids: frozenset | None = None  # students: only enrolled courses
+
+    def sees(self, r: dict) -> bool:
+        if self.org_id is not None and r["org_id"] != self.org_id:
+            return False
+        if self.host_id is not None and r["host_id"] != self.host_id:
+            return False
+        return self.course_ids is None or r["course_id"] in self.course_ids
+
+
+def scope_for(user) -> FeedScope | None:
+    """Feed scope for a user, or None without a membership (sync, may query enrollments)."""
+    if user.is_superuser:
+        return FeedScope(GLOBAL_GROUP, None)
+    mem = memberships(user).primary
+    if not mem:
+        return None
+    group = org_group(mem.organization_id)
+    if mem.role == ROLE_TEACHER:
+        return FeedScope(group, mem.organization_id, host_id=user.id)
+    if mem.role == ROLE_STUDENT:
+        ids = CourseEnrollment.objects.filter(user=user).values_list("course_id", flat=True)
+        return FeedScope(group, mem.organization_id, course_ids=frozenset(ids))
+    return FeedScope(group, mem.organization_id)
+
+
+def row(session: LiveSession) -> dict:
+    """Feed row for a session loaded with quiz, quiz__course and host."""
+    course = session.quiz.course
+    return {
+        "id": session.id,
+        "quiz_title": session.quiz.quiz_title,
+        "course_id": course.id,
+        "course_name": course.course_name,
+        "org_id": course.organization_id,
+        "host_id": session.host_id,
+        "host_name": session.host.get_full_name() or session.host.username,
+        "started_at": session.started_at.isoformat() if session.started_at else None,
+        "join_code": (session.details or {}).get("join_code"),
+    }
+
+
+def _loaded() -> dict[int, dict]:
+    global _index, _loaded_at
+    with _lock:
+        if _index is not None and time.monotonic() - _loaded_at < INDEX_TTL:
+            return _index
+    qs = LiveSession.objects.select_related("quiz", "quiz__course", "host").filter(ended_at__isnull=True)
+    fresh = {s.id: row(s) for s in qs}
+    with _lock:
+        _index, _loaded_at = fresh, time.monotonic()
+        return _index
+
+
+def snapshot(scope: FeedScope, limit: int | None = None) -> list[dict]:
+    """Ongoing sessions visible in scope, newest first (sync; the first call loads the index)."""
+    index = _loaded()
+    with _lock:
+        rows = [r for r in index.values() if scope.sees(r)]
+    rows.sort(key=lambda r: r["id"], reverse=True)
+    return rows[:limit]
+
+
+def _apply(session: LiveSession, op: str) -> tuple[list[str], dict]:
+    """Update the index (if loaded) and build the group message for op."""
+    r = row(session)
+    with _lock:
+        if _index is not None:
+            if op == "remove":
+                _index.pop(session.id, None)
+            else:
+                _index[session.id] = r
+    message = {"type": "ongoing.update", "payload": {"op": op, "session": r}}
+    return [GLOBAL_GROUP, org_group(r["org_id"])], message
+
+
+def publish(session: LiveSession, op: str):
+    """op is "create", "update" or "remove" (ended); sync callers."""
+    groups, message = _apply(session, op)
+    send = async_to_sync(get_channel_layer().group_send)
+    for group in groups:
+        send(group, message)
+
+
+async def apublish(session: LiveSession, op: str):
+    groups, message = _apply(session, op)
+    layer = get_channel_layer()
+    for group in groups:
+        await layer.group_send(group, message)
+
+
+def receive(payload: dict):
+    """Apply a feed delta published by any process to this process's index (if loaded)."""
+    r = payload["session"]
+    with _lock:
+        if _index is not None:
+            if payload["op"] == "remove":
+                _index.pop(r["id"], None)
+            else:
+                _index[r["id"]] = r
+
+
+def forget(session_id: int):
+    """Drop a deleted session and tell its feed (sync; the session row is gone)."""
+    with _lock:
+        r = _index.pop(session_id, None) if _index is not None else None
+    if r is None:
+        return
+    send = async_to_sync(get_channel_layer().group_send)
+    message = {"type": "ongoing.update", "payload": {"op": "remove", "session": r}}
+    for group in (GLOBAL_GROUP, org_group(r["org_id"])):
+        send(group, message)
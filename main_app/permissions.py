@@ -1,6 +1,12 @@
 # apps/orgs/permissions.py
+from typing import NamedTuple
+
+from django.core.cache import cache
+
 from .models import OrgMembership
 
+MEMBERSHIP_CACHE_TTL = 60  # seconds; signals clear entries on membership changes
+
 # Models
 ORG = "organization"
 MEMBERSHIP = "orgmembership"
@@ -80,6 +86,48 @@ ROLE_ACTIONS = {
     },
 }
 
+class Memberships(NamedTuple):
+    roles: dict                      # {organization_id: role (lower-case)}
+    primary: OrgMembership | None    # first membership, organization preloaded
+
+
+NO_MEMBERSHIPS = Memberships({}, None)
+
+
+def _memberships_key(user_id) -> str:
+    return f"perm:memberships:{user_id}"
+
+
+def memberships(user) -> Memberships:
+    """
+    The user's org roles, resolved at most once per user object.
+
+    request.user lives for one request and scope["user"] for one WebSocket
+    connection, so the result is memoised on it; across requests it comes from
+    a short-TTL cache that signals clear when an OrgMembership changes.
+    """
+    if not getattr(user, "is_authenticated", False):
+        return NO_MEMBERSHIPS
+    resolved = getattr(user, "_org_memberships", None)
+    if resolved is not None:
+        return resolved
+    key = _memberships_key(user.pk)
+    resolved = cache.get(key)
+    if resolved is None:
+        rows = list(OrgMembership.objects.select_related("organization").filter(user_id=user.pk))
+        resolved = Memberships(
+            {m.organization_id: (m.role or "").lower() for m in rows},
+            rows[0] if rows else None,
+        )
+        cache.set(key, resolved, MEMBERSHIP_CACHE_TTL)
+    user._org_memberships = resolved
+    return resolved
+
+
+def invalidate_memberships(user_id):
+    cache.delete(_memberships_key(user_id))
+
+
 def allowed(user, action: str, model: str, org=None) -> bool:
     if not getattr(user, "is_authenticated", False):
         return False
@@ -87,12 +135,43 @@ def allowed(user, action: str, model: str, org=None) -> bool:
         return True
     if org is None:
         return False
-    try:
-        role = (
-            OrgMembership.objects.only("role")
-            .get(user=user, organization=org)
-            .role.lower()
-        )
-    except OrgMembership.DoesNotExist:
+    role = memberships(user).roles.get(getattr(org, "pk", org))
+    if role is None:
         return False
     return action in ROLE_ACTIONS.get(role, {}).get(model, set())
+
+
+# capability name -> model it needs READ_ALL on (None: computed separately)
+CAPABILITIES = {
+    "read_all_orgs": ORG,
+    "view_courses": COURSE,
+    "view_quizzes": QUIZ,
+    "view_livesessions": LIVE_SESSION,
+    "view_liveparticipants": LIVE_PARTICIPANT,
+    "student_or_parent": None,
+}
+
+
+def capabilities(user) -> dict:
+    """
+    Navigation capability flags for a user, computed once per user object.
+
+    Derived from memberships(), so across requests the only input is the
+    cached membership entry and building the map costs no queries.
+    """
+    caps = getattr(user, "_capabilities", None)
+    if caps is not None:
+        return caps
+    if not getattr(user, "is_authenticated", False):
+        return dict.fromkeys(CAPABILITIES, False)
+    mem = memberships(user)
+    org = mem.primary.organization_id if mem.primary else None
+    caps = {
+        name: bool(getattr(user, "is_superuser", False) or (org and allowed(user, READ_ALL, model, org=org)))
+        for name, model in CAPABILITIES.items()
+        if model is not None
+    }
+    caps["student_or_parent"] = any(role in {"student", "parents"} for role in mem.roles.values())
+    user._capabilities = caps
+    return caps
+
@@ -0,0 +1,104 @@
+"""
+Answers reports for ended live sessions.
+
+answers_report() lays out every participant's answer per question. It makes a
+single pass over the session's LiveAnswer rows, dropping each into a
+(question, participant) grid, with choice texts resolved once per question, so
+the cost is O(answers + questions x participants) rather than a scan of every
+participant's answers per question.
+
+An ended session never changes, so the first build is stored as a
+LiveSessionReport row and cached; later views read the cache (or that row) and
+never touch LiveAnswer again.
+"""
+from __future__ import annotations
+
+from django.core.cache import cache
+from django.db import IntegrityError
+
+from . import legacy_answers
+from .models import LiveAnswer, LiveParticipant, LiveSessionReport
+
+FORMAT_VERSION = 2  # bump when the report layout changes; older stored reports are rebuilt
+                    # (2: legacy sessions' reports stored before their answers were copied)
+CACHE_TTL = 3600    # seconds
+ANSWER_CHUNK_SIZE = 2000
+
+
+def cache_key(session_id: int) -> str:
+    return f"live:{session_id}:answers_report:v{FORMAT_VERSION}"
+
+
+def build_answers_report(session, questions) -> dict:
+    """{"per_question": [{"index", "question", "rows", "stats"}, ...]} for the session."""
+    participants = list(
+        LiveParticipant.objects.filter(livesession=session)
+        .order_by("user__username")
+        .values_list("id", "user__username", "user__first_name", "user__last_name")
+    )
+    position = {pid: i for i, (pid, *_) in enumerate(participants)}
+    names = [f"{first} {last}".strip() or username for _, username, first, last in participants]
+    texts = [
+        [ch.get("text") or f"Choice {i + 1}" for i, ch in enumerate(q.get("choices") or [])]
+        for q in questions
+    ]
+
+    # (selected texts, points) per question and participant; None = skipped
+    grid = [[None] * len(participants) for _ in questions]
+    answers = (
+        LiveAnswer.objects.filter(livesession=session)
+        .values_list("participant_id", "question_index", "selected", "points")
+        .iterator(chunk_size=ANSWER_CHUNK_SIZE)
+    )
+    for pid, idx, selected, points in answers:
+        pos = position.get(pid)
+        if pos is None or idx >= len(grid):
+            continue
+        choices = texts[idx]
+        grid[idx][pos] = ([choices[i] for i in selected or [] if 0 <= i < len(choices)], points)
+
+    per_question = []
+    for idx, q in enumerate(questions):
+        rows, attempted, correct, total_points = [], 0, 0, 0
+        for name, cell in zip(names, grid[idx]):
+            if cell is None:
+                rows.append({"name": name, "selected_texts": [], "points": 0, "skipped": True})
+                continue
+            selected_texts, points = cell
+            attempted += 1
+            correct += points > 0
+            total_points += points
+            rows.append({"name": name, "selected_texts": selected_texts, "points": points, "skipped": False})
+        per_question.append({
+            "index": idx,
+            "question": q,
+            "rows": rows,
+            "stats": {
+                "attempted": attempted,
+                "correct": correct,
+                "avg_points": round(total_points / max(len(rows), 1), 2),
+            },
+        })
+    return {"per_question": per_question}
+
+
+def answers_report(session, questions) -> dict:
+    """The ended session's report: cache, then the stored row, then a one-off build."""
+    key = cache_key(session.pk)
+    data = cache.get(key)
+    if data is not None:
+        return data
+    stored = LiveSessionReport.objects.filter(livesession=session).only("format_version", "data").first()
+    if stored is not None and stored.format_version == FORMAT_VERSION:
+        data = stored.data
+    else:
+        legacy_answers.copy_session(session.pk)  # answers of sessions from before LiveAnswer
+        data = build_answers_report(session, questions)
+        try:
+            LiveSessionReport.objects.update_or_create(
+                livesession=session, defaults={"format_version": FORMAT_VERSION, "data": data}
+            )
+        except IntegrityError:
+            pass  # a concurrent request stored the same report first
+    cache.set(key, data, CACHE_TTL)
+    return data
@@ -0,0 +1,139 @@
+"""
+Versioned lobby/participant roster for the live session page.
+
+Every roster change (join, admit, start) bumps the session's roster sequence
+number and is broadcast as only the rows that changed:
+
+    {"seq": 8,
+     "lobby": {"added": [row, ...], "removed": [user_id, ...]},
+     "participants": {"added": [row, ...], "removed": [user_id, ...]}}
+
+so admitting N students costs N single-row messages instead of N full lists.
+Clients apply a delta only when its seq is exactly one past the last they
+applied. Anything else means a message was missed (or two workers raced), so
+the client sends {"action": "roster"} and resumes from the full snapshot it
+gets back, which carries the seq it is current to.
+
+Roster data (names, emails) only goes to the session's staff group: the
+host, the course teacher and org admins/managers. Students share the plain
+live_<id> group, which carries state changes and events but no rosters.
+
+The seq lives on the process's LiveState, like the rest of the live session,
+and is read and bumped under the state's lock. start() and admit_waiting()
+re-read the stored lobby first, so students who joined through another
+process are admitted too.
+"""
+from __future__ import annotations
+
+from django.contrib.auth import get_user_model
+
+from .constants import ROLE_ADMIN, ROLE_MANAGER, ROLE_TEACHER
+from .live_state import LiveState, sync_lobby
+
+User = get_user_model()
+
+USER_FIELDS = ("id", "username", "first_name", "last_name", "email")
+
+
+def staff_group(session_id: int) -> str:
+    return f"live_{session_id}_staff"
+
+
+def is_staff(user, role, session) -> bool:
+    """Whether a viewer of the session gets rosters (session loaded with quiz__course)."""
+    if user.is_superuser or user.id == session.host_id or role in (ROLE_ADMIN, ROLE_MANAGER):
+        return True
+    return role == ROLE_TEACHER and session.quiz.course.teacher_id == user.id
+
+
+def _rows(user_ids, host_id: int) -> dict[int, dict]:
+    """{user_id: row} for the given users, host excluded (one query)."""
+    ids = [i for i in user_ids if i != host_id]
+    if not ids:
+        return {}
+    return {u["id"]: u for u in User.objects.filter(id__in=ids).values(*USER_FIELDS)}
+
+
+def _bump(state: LiveState) -> int:
+    with state.lock:
+        state.roster_seq += 1
+        return state.roster_seq
+
+
+def snapshot(state: LiveState) -> dict:
+    """Full lobby (join order) and participants (by username) at the current seq (sync)."""
+    with state.lock:
+        seq = state.roster_seq
+        lobby = list(state.lobby)
+        participants = list(state.participants)
+    rows = _rows(lobby + participants, state.host_id)
+    return {
+        "seq": seq,
+        "lobby": [rows[i] for i in lobby if i in rows],
+        "participants": sorted((rows[i] for i in participants if i in rows), key=lambda r: r["username"]),
+    }
+
+
+def delta(state: LiveState, lobby_added=(), lobby_removed=(), participants_added=(),
+          participants_removed=()) -> dict | None:
+    """Next roster delta for a change already applied to state; None if it touches nobody (sync)."""
+    host = state.host_id
+    lobby_added = [i for i in lobby_added if i != host]
+    lobby_removed = [i for i in lobby_removed if i != host]
+    participants_added = [i for i in participants_added if i != host]
+    participants_removed = [i for i in participants_removed if i != host]
+    if not (lobby_added or lobby_removed or participants_added or participants_removed):
+        return None
+    rows = _rows(lobby_added + participants_added, host)
+    out = {"seq": _bump(state)}
+    if lobby_added or lobby_removed:
+        out["lobby"] = {"added": [rows[i] for i in lobby_added if i in rows], "removed": lobby_removed}
+    if participants_added or participants_removed:
+        out["participants"] = {
+            "added": [rows[i] for i in participants_added if i in rows],
+            "removed": participants_removed,
+        }
+    return out
+
+
+# ----------------------- State changes -----------------------
+# These wrap the LiveState mutations and return what changed as delta()
+# keyword arguments (empty when nothing did). Callers still touch() the state.
+
+def join(state: LiveState, user_id: int) -> dict:
+    return {"lobby_added": [user_id]} if state.add_to_lobby(user_id) else {}
+
+
+def admit(state: LiveState, user_id: int) -> dict:
+    with state.lock:
+        in_lobby = user_id in state.lobby
+        admitted = state.admit(user_id)
+    changes = {}
+    if in_lobby:
+        changes["lobby_removed"] = [user_id]
+    if admitted:
+        changes["participants_added"] = [user_id]
+    return changes
+
+
+def admit_waiting(state: LiveState, user_id: int) -> dict:
+    """A host admitting someone: only users waiting in the lobby, anyone else is ignored (sync)."""
+    with state.lock:
+        waiting = user_id in state.lobby
+    if not waiting:
+        sync_lobby(state)  # they may have joined through another process
+    with state.lock:
+        if user_id not in state.lobby:
+            return {}
+        return admit(state, user_id)
+
+
+def start(state: LiveState, total: int) -> dict | None:
+    """Start the session, admitting the whole lobby; None if it had already started (sync)."""
+    sync_lobby(state)  # joins made through other processes
+    with state.lock:
+        lobby = list(state.lobby)
+        newcomers = [i for i in lobby if i not in state.participants]
+        if not state.start(total):
+            return None
+    return {"lobby_removed": lobby, "participants_added": newcomers}
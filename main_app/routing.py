@@ -1,8 +1,9 @@
 # main_app/routing.py
 from django.urls import re_path
-from .consumers import LiveSessionConsumer, CourseSessionsConsumer
+from .consumers import LiveSessionConsumer, CourseSessionsConsumer, OngoingSessionsConsumer
 
 websocket_urlpatterns = [
     re_path(r"^ws/live/(?P<pk>\d+)/$", LiveSessionConsumer.as_asgi()),
     re_path(r"^ws/courses/(?P<course_id>\d+)/$", CourseSessionsConsumer.as_asgi()),
+    re_path(r"^ws/ongoing/$", OngoingSessionsConsumer.as_asgi()),
 ]
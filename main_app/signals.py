@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import ongoing, stats
+from .models import Organization, OrgMembership, Course, CourseEnrollment, Quiz, LiveSession
+from .permissions import invalidate_memberships
+
+
+@receiver(post_save, sender=OrgMembership)
+@receiver(post_delete, sender=OrgMembership)
+def _membership_changed(sender, instance, **kwargs):
+    invalidate_memberships(instance.user_id)
+
+
+# Dashboard rollups count these models
+for _model in (Organization, OrgMembership, Course, CourseEnrollment, Quiz, LiveSession):
+    post_save.connect(stats.invalidate, sender=_model, dispatch_uid=f"stats_save_{_model.__name__}")
+    post_delete.connect(stats.invalidate, sender=_model, dispatch_uid=f"stats_delete_{_model.__name__}")
+
+
+@receiver(post_save, sender=get_user_model())
+def _user_saved(sender, instance, created, **kwargs):
+    # logins save last_login; only new accounts change the counts
+    if created:
+        stats.invalidate()
+
+
+@receiver(post_delete, sender=get_user_model())
+def _user_deleted(sender, instance, **kwargs):
+    stats.invalidate()
+
+
+@receiver(post_delete, sender=LiveSession)
+def _session_deleted(sender, instance, **kwargs):
+    ongoing.forget(instance.pk)
@@ -0,0 +1,55 @@
+"""
+Cached counters for the dashboards.
+
+count_all() evaluates any number of COUNT(*)s as scalar subqueries of a
+single SELECT. Results are cached under a generation number that signals
+bump whenever a counted model is created, changed or deleted (the live-state
+flusher bumps it too when sessions end, since it writes with bulk_update), so
+a cached rollup never outlives the rows it summarises.
+"""
+from __future__ import annotations
+
+import time
+
+from django.core.cache import cache
+from django.db import connection
+
+DASHBOARD_TTL = 300  # seconds; a safety net, invalidation is event-driven
+_GENERATION_KEY = "stats:generation"
+
+
+def count_all(**querysets) -> dict[str, int]:
+    """{name: row count} for each queryset, in one round trip."""
+    qn = connection.ops.quote_name
+    parts, params = [], []
+    for name, qs in querysets.items():
+        sql, p = qs.order_by().values("pk").query.sql_with_params()
+        parts.append(f"(SELECT COUNT(*) FROM ({sql}) {qn('_' + name)}) AS {qn(name)}")
+        params.extend(p)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT " + ", ".join(parts), params)
+        row = cursor.fetchone()
+    return dict(zip(querysets, row))
+
+
+def generation() -> int:
+    # seeded from the clock so an evicted counter never reuses an old number
+    return cache.get_or_set(_GENERATION_KEY, time.time_ns, None)
+
+
+def invalidate(**kwargs):
+    """Drop every cached rollup (usable directly as a signal receiver)."""
+    try:
+        cache.incr(_GENERATION_KEY)
+    except ValueError:
+        cache.set(_GENERATION_KEY, time.time_ns(), None)
+
+
+def cached(name: str, build, *scope, ttl: int = DASHBOARD_TTL):
+    """build() cached per (name, scope) until the next invalidate()."""
+    key = ":".join(["stats", str(generation()), name, *map(str, scope)])
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, ttl)
+    return value
@@ -1,3 +1,803 @@
-from django.test import TestCase
+import csv
+import io
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import answer_key, exports, gradebook, jobs, leaderboard, legacy_answers, live_state, permissions, reports, roster
+from .models import (
+    Course, CourseEnrollment, Job, LiveAnswer, LiveJoinCode, LiveLeaderboard, LiveLobbyEntry, LiveParticipant,
+    LiveSession, LiveSessionReport, Organization, OrgMembership, Quiz,
+)
+
+User = get_user_model()
+
+
+def _live_session(scores: dict[str, int], ended: bool = True) -> LiveSession:
+    """A session whose participants (by username) scored the given points on question 0."""
+    host = User.objects.create_user("host")
+    org = Organization.objects.create(name="Org", country="US")
+    course = Course.objects.create(
+        organization=org, teacher=host, course_name="Course", join_code="C1", subject_category="math"
+    )
+    quiz = Quiz.objects.create(course=course, quiz_title="Quiz", content=[])
+    session = LiveSession.objects.create(quiz=quiz, host=host, ended_at=timezone.now() if ended else None)
+    for username, points in scores.items():
+        p = LiveParticipant.objects.create(livesession=session, user=User.objects.create_user(username))
+        LiveAnswer.objects.create(livesession=session, participant=p, question_index=0, selected=[0], points=points)
+    return session
+
+
+def _evaluate(question: dict, selected_indexes) -> int:
+    """The set-based grader AnswerKey replaced, kept as the reference."""
+    qtype = (question.get("question_type") or "").upper()
+    choices = question.get("choices") or []
+    sel = {int(i) for i in selected_indexes}
+    correct = {i for i, ch in enumerate(choices) if bool(ch.get("is_correct"))}
+    if qtype == "MSQ":
+        return answer_key.POINTS_PER_QUESTION if sel == correct else 0
+    if len(sel) != 1:
+        return 0
+    return answer_key.POINTS_PER_QUESTION if next(iter(sel)) in correct else 0
+
+
+class AnswerKeyTests(SimpleTestCase):
+    content = [
+        {"question_type": "MCQ", "choices": [{"is_correct": False}, {"is_correct": True}, {"is_correct": False}]},
+        {"question_type": "MSQ", "choices": [{"is_correct": True}, {"is_correct": False}, {"is_correct": True}]},
+        {"question_type": "MCQ", "choices": []},
+    ]
+    selections = [
+        [], [0], [1], [2], [1, 1], [0, 1], [0, 2], [2, 0], [0, 1, 2], [0, 2, 2],
+        [3], [-1], [1, 3], [0, 2, 5], [1000000000], [2 ** 63],
+    ]
+
+    def setUp(self):
+        self.key = answer_key.AnswerKey(1, 1, self.content)
+
+    def test_matches_set_based_grader(self):
+        for idx, question in enumerate(self.content):
+            for sel in self.selections:
+                with self.subTest(idx=idx, sel=sel):
+                    self.assertEqual(self.key.grade(idx, sel), _evaluate(question, sel))
+
+    def test_out_of_range_question(self):
+        self.assertEqual(self.key.grade(3, [0]), 0)
+        self.assertEqual(self.key.grade(-1, [1]), 0)
+
+    def test_long_selection_scores_zero(self):
+        self.assertEqual(self.key.grade(0, [1] * (answer_key.MAX_SELECTED + 1)), 0)
+
+    def test_parse_selected(self):
+        self.assertEqual(answer_key.parse_selected(["1", 2]), [1, 2])
+        self.assertEqual(answer_key.parse_selected(None), [])
+        self.assertEqual(answer_key.parse_selected("12"), [])
+        self.assertEqual(answer_key.parse_selected(["x"]), [])
+        self.assertEqual(answer_key.parse_selected([float("inf")]), [])
+        self.assertEqual(answer_key.parse_selected([0] * (answer_key.MAX_SELECTED + 1)), [])
+
+
+class EnsureFinalConcurrencyTests(TransactionTestCase):
+    def test_concurrent_callers_write_rows_once(self):
+        session = _live_session({"a": 10, "b": 20, "c": 10})
+        start = threading.Barrier(4)
+        results, errors = [], []
+
+        def finalise():
+            try:
+                mine = LiveSession.objects.get(pk=session.pk)
+                start.wait()
+                results.append(leaderboard.ensure_final(mine))
+            except Exception as exc:  # pragma: no cover - the failure being tested for
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=finalise) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), [False, False, False, True])
+        self.assertEqual(LiveLeaderboard.objects.filter(livesession=session).count(), 3)
+        session.refresh_from_db()
+        self.assertIsNotNone(session.leaderboard_finalised_at)
+
+
+class LiveStateVersionTests(TestCase):
+    """Another process's session writes (simulated with update()) are merged, never undone."""
+
+    def setUp(self):
+        self.session = _live_session({}, ended=False)
+        self.state = live_state.get_state(self.session)
+        self.state.start(3)
+        live_state.touch(self.state)
+        self.addCleanup(live_state._states.pop, self.session.pk, None)
+
+    def _other_process_writes(self, **fields):
+        row = LiveSession.objects.get(pk=self.session.pk)
+        LiveSession.objects.filter(pk=row.pk).update(state_version=row.state_version + 1, **fields)
+
+    def test_stale_flush_keeps_other_advance(self):
+        self._other_process_writes(details={**self.state.details(), "current_index": 2})
+        self.state.set_join_code("NEWCODE")  # a local change flushed from the stale version
+        live_state.touch(self.state)
+        row = LiveSession.objects.get(pk=self.session.pk)
+        self.assertEqual(row.details["current_index"], 2)
+        self.assertEqual(row.details["join_code"], "NEWCODE")
+        self.assertEqual(self.state.current_index, 2)
+
+    def test_stale_flush_keeps_other_end(self):
+        ended = timezone.now()
+        self._other_process_writes(ended_at=ended)
+        self.assertTrue(self.state.advance())
+        live_state.touch(self.state)
+        row = LiveSession.objects.get(pk=self.session.pk)
+        self.assertEqual(row.ended_at, ended)
+        self.assertEqual(row.details["current_index"], 1)
+        self.assertTrue(self.state.ended)
+
+    def test_get_state_merges_newer_row(self):
+        self._other_process_writes(details={**self.state.details(), "current_index": 1})
+        state = live_state.get_state(LiveSession.objects.get(pk=self.session.pk))
+        self.assertIs(state, self.state)
+        self.assertEqual(state.idx_and_total(), (1, 3))
+
+    def test_idle_states_are_evicted(self):
+        with live_state._lock:
+            live_state._evict_idle(self.state.last_used + live_state.IDLE_TTL + 1)
+        self.assertIsNone(live_state.peek(self.session.pk))
+
+
+class AnswerIngestTests(TestCase):
+    def test_answer_stored_by_another_process_is_not_counted(self):
+        session = _live_session({}, ended=False)
+        user = User.objects.create_user("a")
+        participant = LiveParticipant.objects.create(livesession=session, user=user)
+        state = live_state.get_state(session)
+        self.addCleanup(live_state._states.pop, session.pk, None)
+        # another process stores this user's answer after our state was loaded
+        LiveAnswer.objects.create(livesession=session, participant=participant, question_index=0, selected=[1], points=0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(live_state.queue_answer(state, user.id, 0, [0], 10))  # no loop: flushed now
+
+        self.assertEqual(state.ranking.score(user.id), 0)
+        self.assertEqual(list(LiveAnswer.objects.values_list("points", flat=True)), [0])
+        self.assertEqual(leaderboard.freeze(session).standing(user.id)["score"], 0)
+
+
+class FlushIsolationTests(TestCase):
+    """One session's bad rows must not block the other sessions in the same flush."""
+
+    def setUp(self):
+        self.good = _live_session({}, ended=False)
+        self.bad = LiveSession.objects.create(quiz=self.good.quiz, host=self.good.host)
+        self.user = User.objects.create_user("a")
+        self.good_state = live_state.get_state(self.good)
+        self.bad_state = live_state.get_state(self.bad)
+        for pk in (self.good.pk, self.bad.pk):
+            self.addCleanup(live_state._states.pop, pk, None)
+        patcher = mock.patch.object(live_state, "_schedule")  # queue only; the test flushes
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_admit_ignores_users_not_waiting(self):
+        roster.join(self.good_state, self.user.id)
+        for uid in (0, self.user.id + 1000, self.good.host_id):
+            with self.subTest(uid=uid):
+                self.assertEqual(roster.admit_waiting(self.good_state, uid), {})
+        self.assertEqual(self.good_state.participants, set())
+        self.assertEqual(
+            roster.admit_waiting(self.good_state, self.user.id),
+            {"lobby_removed": [self.user.id], "participants_added": [self.user.id]},
+        )
+
+    def test_rows_for_unknown_users_are_skipped(self):
+        self.bad_state.admit(self.user.id + 1000)  # e.g. admitted by id without a check
+        self.good_state.add_to_lobby(self.user.id)
+        live_state.touch(self.bad_state)
+        live_state.touch(self.good_state)
+
+        with self.assertLogs("main_app.live_state", "WARNING"):
+            self.assertEqual(live_state.flush_now(), 2)
+
+        self.assertFalse(LiveParticipant.objects.filter(livesession=self.bad).exists())
+        self.assertTrue(LiveLobbyEntry.objects.filter(livesession=self.good, user=self.user).exists())
+
+    def test_failing_session_is_dropped_alone(self):
+        insert = live_state._insert_answers
+
+        def failing_insert(answers):
+            insert(answers)
+            if self.bad.pk in answers:
+                raise IntegrityError("constraint failed")
+
+        live_state.queue_answer(self.bad_state, self.user.id, 0, [0], 0)
+        live_state.queue_answer(self.good_state, self.user.id, 0, [1], 10)
+
+        with mock.patch.object(live_state, "_insert_answers", failing_insert), \
+                self.assertLogs("main_app.live_state", "ERROR"):
+            live_state.flush_now()
+
+        self.assertEqual(list(LiveAnswer.objects.values_list("livesession_id", "points")), [(self.good.pk, 10)])
+        self.assertFalse(LiveParticipant.objects.filter(livesession=self.bad).exists())
+        self.assertEqual(live_state.pending_answers(), 0)
+        self.assertEqual(live_state.flush_now(), 0)  # nothing was put back for a retry
+
+
+class RankingTests(SimpleTestCase):
+    def test_dense_ranks_share_ties(self):
+        ranking = leaderboard.Ranking({1: 10, 2: 30, 3: 10, 4: 20, 5: 0})
+        self.assertEqual(ranking.dense(), [(1, 2, 30), (2, 4, 20), (3, 1, 10), (3, 3, 10), (4, 5, 0)])
+        self.assertEqual(ranking.dense(3), [(1, 2, 30), (2, 4, 20), (3, 1, 10)])
+
+    def test_add_reorders_and_positions(self):
+        ranking = leaderboard.Ranking()
+        ranking.add(1)
+        ranking.add(2, 10)
+        ranking.add(3, 10)
+        self.assertEqual([ranking.position(u) for u in (1, 2, 3)], [3, 1, 2])  # ties: lower user id first
+        self.assertEqual(ranking.add(1, 20), 20)
+        self.assertEqual(ranking.top(), [(1, 20), (2, 10), (3, 10)])
+        self.assertEqual(ranking.position(1), 1)
+        self.assertIsNone(ranking.position(99))
+
+    def test_version_moves_only_on_change(self):
+        ranking = leaderboard.Ranking({1: 5})
+        ranking.add(1, 0)
+        self.assertEqual(ranking.version, 0)
+        ranking.add(1, 5)
+        ranking.add(2)
+        self.assertEqual(ranking.version, 2)
+        self.assertEqual(len(ranking), 2)
+
+
+class FinaliseTests(TestCase):
+    def setUp(self):
+        self.session = _live_session({"a": 20, "b": 10, "c": 10, "d": 0})
+        self.pid = dict(
+            LiveParticipant.objects.filter(livesession=self.session).values_list("user__username", "id")
+        )
+        self.uid = dict(User.objects.values_list("username", "id"))
+
+    def _row(self, username, rank, score):
+        LiveLeaderboard.objects.create(
+            livesession=self.session, participant_id=self.pid[username], rank=rank, score=score
+        )
+
+    def test_creates_updates_and_deletes_rows(self):
+        self._row("a", 5, 0)   # wrong: updated
+        self._row("b", 2, 10)  # right: left alone
+        self._row("d", 4, 0)   # not ranked any more: deleted
+        ranking = leaderboard.Ranking({self.uid["a"]: 20, self.uid["b"]: 10, self.uid["c"]: 10})
+
+        stats = leaderboard.finalise(self.session, ranking)
+
+        self.assertEqual(
+            {k: stats[k] for k in ("rows", "created", "updated", "deleted")},
+            {"rows": 3, "created": 1, "updated": 1, "deleted": 1},
+        )
+        self.assertEqual(
+            sorted(LiveLeaderboard.objects.values_list("participant__user__username", "rank", "score")),
+            [("a", 1, 20), ("b", 2, 10), ("c", 2, 10)],
+        )
+
+    def test_marker_stops_a_second_finalise(self):
+        self.assertTrue(leaderboard.ensure_final(self.session))
+        stamped = LiveSession.objects.get(pk=self.session.pk).leaderboard_finalised_at
+        self.assertIsNotNone(stamped)
+
+        stale = LiveSession.objects.get(pk=self.session.pk)
+        stale.leaderboard_finalised_at = None  # a caller loaded before the marker was set
+        LiveLeaderboard.objects.filter(livesession=self.session).update(score=99)
+        self.assertIsNone(leaderboard.finalise(stale, leaderboard.Ranking(leaderboard.load_scores(stale.pk))))
+        self.assertFalse(leaderboard.ensure_final(stale))
+        self.assertEqual(stale.leaderboard_finalised_at, stamped)
+        self.assertEqual(set(LiveLeaderboard.objects.values_list("score", flat=True)), {99})
+
+    def test_ranks_all_participants_densely(self):
+        leaderboard.ensure_final(self.session)
+        self.assertEqual(
+            list(
+                LiveLeaderboard.objects.order_by("rank", "participant__user__username")
+                .values_list("participant__user__username", "rank")
+            ),
+            [("a", 1), ("b", 2), ("c", 2), ("d", 3)],
+        )
+
+
+class LegacySessionTests(TestCase):
+    """Sessions that ended before LiveAnswer and the finalised marker existed."""
+
+    def setUp(self):
+        self.session = _live_session({})
+        self.pid = {}
+        for username, answers in {
+            "a": [{"question_id": 0, "selected": [1], "points": 10}, {"question_id": 1, "selected": ["0"], "points": 5}],
+            "b": [{"question_id": 0, "selected": [0], "points": 0}, {"question_id": 0, "selected": [1], "points": 10}],
+        }.items():
+            p = LiveParticipant.objects.create(
+                livesession=self.session, user=User.objects.create_user(username), answer_questions=answers
+            )
+            self.pid[username] = p.id
+
+    def test_existing_rows_are_kept_and_marked_final(self):
+        LiveLeaderboard.objects.create(livesession=self.session, participant_id=self.pid["a"], rank=1, score=15)
+        LiveLeaderboard.objects.create(livesession=self.session, participant_id=self.pid["b"], rank=2, score=0)
+
+        self.assertFalse(leaderboard.ensure_final(self.session))
+
+        self.assertIsNotNone(LiveSession.objects.get(pk=self.session.pk).leaderboard_finalised_at)
+        self.assertEqual(
+            sorted(LiveLeaderboard.objects.values_list("participant__user__username", "rank", "score")),
+            [("a", 1, 15), ("b", 2, 0)],
+        )
+        self.assertEqual(LiveAnswer.objects.filter(livesession=self.session).count(), 3)
+
+    def test_json_answers_are_copied_before_ranking(self):
+        self.assertTrue(leaderboard.ensure_final(self.session))
+
+        self.assertEqual(
+            sorted(LiveLeaderboard.objects.values_list("participant__user__username", "rank", "score")),
+            [("a", 1, 15), ("b", 2, 0)],  # b's first answer to question 0 wins
+        )
+        self.assertEqual(legacy_answers.copy_session(self.session.pk), 3)  # offered again, ...
+        self.assertEqual(LiveAnswer.objects.filter(livesession=self.session).count(), 3)  # ... stored once
+
+    def test_report_reads_json_answers(self):
+        questions = [{"choices": [{"text": "No"}, {"text": "Yes"}]}, {"choices": [{"text": "X"}]}]
+
+        data = reports.answers_report(self.session, questions)
+
+        first = data["per_question"][0]
+        self.assertEqual(
+            [(r["name"], r["selected_texts"], r["points"], r["skipped"]) for r in first["rows"]],
+            [("a", ["Yes"], 10, False), ("b", ["No"], 0, False)],
+        )
+        self.assertEqual(data["per_question"][1]["stats"]["attempted"], 1)
+
+
+class RosterTests(TestCase):
+    def setUp(self):
+        self.session = _live_session({}, ended=False)
+        self.state = live_state.get_state(self.session)
+        self.addCleanup(live_state._states.pop, self.session.pk, None)
+        self.a = User.objects.create_user("a")
+        self.b = User.objects.create_user("b")
+
+    def _delta(self, changes):
+        return roster.delta(self.state, **changes)
+
+    def test_deltas_carry_consecutive_seqs(self):
+        first = self._delta(roster.join(self.state, self.a.id))
+        self.assertEqual(first["seq"], 1)
+        self.assertEqual([r["username"] for r in first["lobby"]["added"]], ["a"])
+        self.assertNotIn("participants", first)
+
+        second = self._delta(roster.admit(self.state, self.a.id))
+        self.assertEqual(second["seq"], 2)
+        self.assertEqual(second["lobby"], {"added": [], "removed": [self.a.id]})
+        self.assertEqual([r["id"] for r in second["participants"]["added"]], [self.a.id])
+
+    def test_no_change_sends_nothing(self):
+        self._delta(roster.join(self.state, self.a.id))
+        self.assertEqual(roster.join(self.state, self.a.id), {})
+        self.assertIsNone(self._delta(roster.join(self.state, self.a.id)))
+        self.assertIsNone(self._delta(roster.join(self.state, self.session.host_id)))  # host is never listed
+        self.assertEqual(roster.snapshot(self.state)["seq"], 1)
+
+    def test_snapshot_resyncs_a_client_that_missed_deltas(self):
+        self._delta(roster.join(self.state, self.a.id))
+        self._delta(roster.join(self.state, self.b.id))  # say the client missed this one
+        last = self._delta(roster.start(self.state, total=2))
+        self.assertIsNone(roster.start(self.state, total=2))
+
+        snap = roster.snapshot(self.state)
+        self.assertEqual(snap["seq"], last["seq"])
+        self.assertEqual(snap["lobby"], [])
+        self.assertEqual([r["username"] for r in snap["participants"]], ["a", "b"])
+        self.assertEqual(sorted(last["participants"]["added"], key=lambda r: r["id"]), snap["participants"])
+
+    def test_start_admits_joins_from_other_processes(self):
+        roster.join(self.state, self.a.id)
+        live_state.touch(self.state)
+        LiveLobbyEntry.objects.create(livesession=self.session, user=self.b)  # joined through another process
+
+        changes = roster.start(self.state, total=2)
+
+        self.assertEqual(sorted(changes["participants_added"]), [self.a.id, self.b.id])
+        live_state.touch(self.state)
+        self.assertFalse(LiveLobbyEntry.objects.exists())
+        self.assertEqual(LiveParticipant.objects.filter(livesession=self.session).count(), 2)
+
+    def test_admit_finds_joins_from_other_processes(self):
+        LiveLobbyEntry.objects.create(livesession=self.session, user=self.b)
+        self.assertEqual(
+            roster.admit_waiting(self.state, self.b.id),
+            {"lobby_removed": [self.b.id], "participants_added": [self.b.id]},
+        )
+
+    def test_sync_drops_users_admitted_elsewhere(self):
+        roster.join(self.state, self.a.id)
+        live_state.touch(self.state)
+        roster.join(self.state, self.b.id)  # not flushed yet: kept
+        LiveLobbyEntry.objects.filter(user=self.a).delete()  # another process admitted a
+
+        self.assertEqual(live_state.sync_lobby(self.state), ([], [self.a.id]))
+        self.assertEqual(list(self.state.lobby), [self.b.id])
+
+
+class JoinCodeTests(TestCase):
+    def setUp(self):
+        self.session = _live_session({}, ended=False)
+        self.other = LiveSession.objects.create(quiz=self.session.quiz, host=self.session.host)
+        LiveJoinCode.objects.create(livesession=self.other, code="TAKEN1")
+
+    def test_assign_retries_after_collision(self):
+        with mock.patch("main_app.models._short_code", side_effect=["TAKEN1", "TAKEN1", "FRESH1"]) as short_code:
+            self.assertEqual(LiveJoinCode.assign(self.session), "FRESH1")
+        self.assertEqual(short_code.call_count, 3)
+        self.assertEqual(LiveJoinCode.resolve("FRESH1"), self.session)
+        self.assertEqual(LiveJoinCode.resolve("TAKEN1"), self.other)
+
+    def test_assign_widens_codes_then_gives_up(self):
+        with mock.patch("main_app.models._short_code", return_value="TAKEN1") as short_code:
+            with self.assertRaises(RuntimeError):
+                LiveJoinCode.assign(self.session, length=6, attempts=9)
+        self.assertEqual([c.args[0] for c in short_code.call_args_list], [6] * 4 + [7] * 4 + [8])
+        self.assertFalse(LiveJoinCode.objects.filter(livesession=self.session).exists())
+
+    def test_reassign_replaces_the_code(self):
+        with mock.patch("main_app.models._short_code", side_effect=["FIRST1", "SECOND"]):
+            LiveJoinCode.assign(self.session)
+            LiveJoinCode.assign(self.session)
+        self.assertEqual(LiveJoinCode.objects.filter(livesession=self.session).count(), 1)
+        self.assertIsNone(LiveJoinCode.resolve("FIRST1"))
+        self.assertEqual(LiveJoinCode.resolve("SECOND"), self.session)
+
+    def test_code_is_released_when_the_session_ends(self):
+        state = live_state.get_state(LiveSession.objects.get(pk=self.other.pk))
+        self.addCleanup(live_state._states.pop, self.other.pk, None)
+        state.end()
+        with self.captureOnCommitCallbacks(execute=True):
+            live_state.touch(state)
+
+        self.assertIsNone(LiveJoinCode.resolve("TAKEN1"))
+        with mock.patch("main_app.models._short_code", return_value="TAKEN1"):
+            self.assertEqual(LiveJoinCode.assign(self.session), "TAKEN1")
+
+    def test_register_join_codes(self):
+        LiveJoinCode.objects.all().delete()
+        quiz, host = self.session.quiz, self.session.host
+        LiveSession.objects.filter(pk=self.session.pk).update(details={"join_code": "abc123"})
+        LiveSession.objects.filter(pk=self.other.pk).update(details={"join_code": "ABC123"})  # clashes
+        ended = LiveSession.objects.create(quiz=quiz, host=host, ended_at=timezone.now(), details={"join_code": "OLD1"})
+        blank = LiveSession.objects.create(quiz=quiz, host=host)
+
+        out = io.StringIO()
+        call_command("register_join_codes", stdout=out)
+
+        self.assertIn("Registered 1 join codes, issued 2 new ones.", out.getvalue())
+        codes = dict(LiveJoinCode.objects.values_list("livesession_id", "code"))
+        self.assertEqual(set(codes), {self.session.pk, self.other.pk, blank.pk})
+        self.assertNotIn(ended.pk, codes)
+        self.assertEqual(codes[self.session.pk], "ABC123")
+        for pk in (self.other.pk, blank.pk):
+            self.assertEqual(LiveSession.objects.get(pk=pk).details["join_code"], codes[pk])
+
+        call_command("register_join_codes", stdout=out)  # re-run: nothing left to do
+        self.assertIn("Registered 0 join codes, issued 0 new ones.", out.getvalue())
+        self.assertEqual(dict(LiveJoinCode.objects.values_list("livesession_id", "code")), codes)
+
+
+class MembershipCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.org = Organization.objects.create(name="Org", country="US")
+        self.user = User.objects.create_user("t")
+        self.membership = OrgMembership.objects.create(organization=self.org, user=self.user, role="Teacher")
+
+    def _fresh(self):
+        return User.objects.get(pk=self.user.pk)  # a new request's user: nothing memoised on it
+
+    def test_allowed_makes_no_queries_after_first_lookup(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(permissions.allowed(self.user, permissions.CREATE, permissions.QUIZ, org=self.org))
+        with self.assertNumQueries(0):
+            self.assertTrue(permissions.allowed(self.user, permissions.READ_ONE, permissions.COURSE, org=self.org))
+            self.assertFalse(permissions.allowed(self.user, permissions.CREATE, permissions.COURSE, org=self.org.pk))
+            self.assertFalse(permissions.allowed(self.user, permissions.READ_ONE, permissions.COURSE, org=self.org.pk + 1))
+        user = self._fresh()
+        with self.assertNumQueries(0):  # from the shared cache
+            self.assertTrue(permissions.allowed(user, permissions.CREATE, permissions.QUIZ, org=self.org))
+
+    def test_membership_changes_clear_the_cached_entry(self):
+        self.assertEqual(permissions.memberships(self._fresh()).roles, {self.org.pk: "teacher"})
+
+        self.membership.role = "admin"
+        self.membership.save()
+        self.assertEqual(permissions.memberships(self._fresh()).roles, {self.org.pk: "admin"})
+
+        self.membership.delete()
+        user = self._fresh()
+        self.assertEqual(permissions.memberships(user), permissions.NO_MEMBERSHIPS)
+        self.assertFalse(permissions.allowed(user, permissions.READ_ONE, permissions.ORG, org=self.org))
+
+        OrgMembership.objects.create(organization=self.org, user=self.user, role="student")
+        self.assertEqual(permissions.memberships(self._fresh()).roles, {self.org.pk: "student"})
+
+
+class ExportTests(TestCase):
+    questions = [
+        {"choices": [{"text": "A"}, {"text": "B"}]},
+        {"choices": [{"text": "X"}, {"text": ""}]},
+    ]
+
+    def setUp(self):
+        # five participants exported two at a time: pages of 2, 2 and 1
+        self.session = _live_session({"e": 0, "b": 10, "d": 10, "a": 20, "c": 0})
+        b = LiveParticipant.objects.get(livesession=self.session, user__username="b")
+        LiveAnswer.objects.create(livesession=self.session, participant=b, question_index=1, selected=[0, 1], points=5)
+        leaderboard.ensure_final(self.session)
+
+    def _batches(self):
+        return list(exports.result_batches(self.session, self.questions, batch_size=2))
+
+    def test_batches_keep_every_row_once(self):
+        with self.assertNumQueries(7):  # two per page, then one to find the end
+            batches = self._batches()
+
+        self.assertEqual(batches[0], [exports.header(self.questions)])
+        self.assertEqual([len(rows) for rows in batches[1:]], [2, 2, 1])
+        rows = [row for rows in batches[1:] for row in rows]
+        self.assertEqual([row[1] for row in rows], ["a", "b", "c", "d", "e"])
+        self.assertEqual(len(rows[0]), len(batches[0][0]))
+        self.assertEqual(rows[1], [2, "b", "", "", 15, 10, "A", 5, "X; Choice 2"])
+        self.assertEqual(rows[2], [4, "c", "", "", 0, 0, "A", 0, ""])
+
+    def test_csv_and_xlsx_match_the_batches(self):
+        expected = [[str(cell) for cell in row] for rows in self._batches() for row in rows]
+
+        chunks = list(exports.csv_chunks(iter(self._batches())))
+        self.assertEqual(chunks[0], "\ufeff")
+        self.assertEqual(len(chunks), 1 + 4)  # BOM, then one chunk per batch
+        self.assertEqual(list(csv.reader(io.StringIO("".join(chunks[1:])))), expected)
+
+        out, size = exports.xlsx_file(iter(self._batches()))
+        with out:
+            data = b"".join(exports.file_chunks(out, chunk_size=1024))
+        self.assertEqual(len(data), size)
+        sheet = openpyxl.load_workbook(io.BytesIO(data), read_only=True)["Results"]
+        cells = [["" if cell is None else str(cell) for cell in row] for row in sheet.iter_rows(values_only=True)]
+        self.assertEqual(cells, expected)
+
+    def test_streaming_content_under_wsgi_and_asgi(self):
+        chunks = ["a", "b", "c"]
+        wsgi = exports.streaming_content(RequestFactory().get("/"), chunks)
+        self.assertIs(wsgi, chunks)
+
+        asgi = exports.streaming_content(AsyncRequestFactory().get("/"), iter(chunks))
+        self.assertFalse(hasattr(asgi, "__iter__"))
+
+        async def drain():
+            return [chunk async for chunk in asgi]
+
+        self.assertEqual(async_to_sync(drain)(), chunks)
+
+
+class GradebookTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.first = _live_session({"a": 20, "b": 10})
+        LiveSession.objects.filter(pk=self.first.pk).update(ended_at=timezone.now() - timedelta(hours=1))
+        self.course = self.first.quiz.course
+        self.users = {u.username: u for u in User.objects.all()}
+        # a legacy session: b's answer is still only in the JSON list
+        self.second = LiveSession.objects.create(quiz=self.first.quiz, host=self.first.host, ended_at=timezone.now())
+        a = LiveParticipant.objects.create(livesession=self.second, user=self.users["a"])
+        LiveAnswer.objects.create(livesession=self.second, participant=a, question_index=0, points=5)
+        LiveParticipant.objects.create(
+            livesession=self.second, user=self.users["b"], answer_questions=[{"question_id": 0, "points": 7}]
+        )
+        CourseEnrollment.objects.create(course=self.course, user=User.objects.create_user("z"))
+
+    def _cells(self, data):
+        return [(row[0], row[3:]) for row in data["rows"]]
+
+    def test_matrix_totals_averages_and_blanks(self):
+        data = gradebook.matrix(self.course)
+
+        self.assertEqual(data["header"][:3], ["Username", "Name", "Email"])
+        self.assertTrue(data["header"][3].startswith(f"Quiz #{self.first.pk} ("))
+        self.assertTrue(data["header"][4].startswith(f"Quiz #{self.second.pk} ("))
+        self.assertEqual(data["header"][5:], ["Total", "Sessions", "Average"])
+        self.assertEqual(self._cells(data), [
+            ("a", [20, 5, 25, 2, 12.5]),
+            ("b", [10, 7, 17, 2, 8.5]),
+            ("z", [None, None, 0, 0, None]),  # enrolled, never took part: blank cells
+        ])
+        self.assertEqual([len(rows) for rows in gradebook.batches(data, batch_size=2)], [1, 2, 1])
+
+    def test_cache_is_reused_until_another_session_ends(self):
+        first = gradebook.matrix(self.course)
+        with self.assertNumQueries(2):  # unfinalised sessions and the stamp; the table is cached
+            self.assertEqual(gradebook.matrix(self.course), first)
+
+        session = LiveSession.objects.create(quiz=self.first.quiz, host=self.first.host, ended_at=timezone.now())
+        z = LiveParticipant.objects.create(livesession=session, user=User.objects.get(username="z"))
+        LiveAnswer.objects.create(livesession=session, participant=z, question_index=0, points=3)
+
+        data = gradebook.matrix(self.course)
+        self.assertEqual(len(data["header"]), len(first["header"]) + 1)
+        self.assertEqual(self._cells(data)[2], ("z", [None, None, 3, 3, 1, 3.0]))
+
+
+class AnswersReportTests(TestCase):
+    questions = [
+        {"question": "one", "choices": [{"text": "A"}, {"text": "B"}]},
+        {"question": "two", "choices": [{"text": "X"}, {}]},
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.session = _live_session({"a": 10, "b": 0, "c": 10})
+        c = LiveParticipant.objects.get(livesession=self.session, user__username="c")
+        LiveAnswer.objects.create(livesession=self.session, participant=c, question_index=1, selected=[1, 0], points=4)
+        LiveAnswer.objects.create(livesession=self.session, participant=c, question_index=7, selected=[0], points=9)
+
+    def test_per_question_rows_and_stats(self):
+        data = reports.answers_report(self.session, self.questions)
+
+        first, second = data["per_question"]
+        self.assertEqual((first["index"], first["question"]), (0, self.questions[0]))
+        self.assertEqual([r["name"] for r in first["rows"]], ["a", "b", "c"])
+        self.assertEqual(first["stats"], {"attempted": 3, "correct": 2, "avg_points": 6.67})
+        self.assertEqual(
+            [(r["selected_texts"], r["points"], r["skipped"]) for r in second["rows"]],
+            [([], 0, True), ([], 0, True), (["Choice 2", "X"], 4, False)],
+        )
+        self.assertEqual(second["stats"], {"attempted": 1, "correct": 1, "avg_points": 1.33})
+
+    def test_stored_report_is_reused(self):
+        data = reports.answers_report(self.session, self.questions)
+        stored = LiveSessionReport.objects.get(livesession=self.session)
+        self.assertEqual((stored.format_version, stored.data), (reports.FORMAT_VERSION, data))
+
+        LiveAnswer.objects.filter(livesession=self.session).delete()  # would change a rebuilt report
+        with self.assertNumQueries(0):  # cached
+            self.assertEqual(reports.answers_report(self.session, self.questions), data)
+        cache.clear()
+        with self.assertNumQueries(1):  # the stored row
+            self.assertEqual(reports.answers_report(self.session, self.questions), data)
+
+    def test_outdated_report_is_rebuilt(self):
+        LiveSessionReport.objects.create(
+            livesession=self.session, format_version=reports.FORMAT_VERSION - 1, data={"old": True}
+        )
+        data = reports.answers_report(self.session, self.questions)
+        self.assertEqual(len(data["per_question"]), 2)
+        self.assertEqual(LiveSessionReport.objects.get(livesession=self.session).data, data)
+
+
+class LiveSessionDetailTests(TestCase):
+    def setUp(self):
+        self.session = _live_session({}, ended=False)
+        org = self.session.quiz.course.organization
+        OrgMembership.objects.create(organization=org, user=self.session.host, role="teacher")
+        self.student = User.objects.create_user("s", email="s@example.com")
+        self.waiting = User.objects.create_user("w", email="w@example.com")
+        for user in (self.student, self.waiting):
+            OrgMembership.objects.create(organization=org, user=user, role="student")
+        self.state = live_state.get_state(self.session)
+        self.addCleanup(live_state._states.pop, self.session.pk, None)
+        roster.join(self.state, self.waiting.id)
+        roster.admit(self.state, self.student.id)
+        live_state.touch(self.state)
+        self.url = reverse("livesession_detail", args=[self.session.pk])
+
+    def test_staff_see_rosters(self):
+        self.client.force_login(self.session.host)
+        response = self.client.get(self.url)
+        self.assertContains(response, "w@example.com")
+        self.assertContains(response, "s@example.com")
+
+    def test_students_do_not_see_rosters(self):
+        self.client.force_login(self.student)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "@example.com")
+        self.assertNotContains(response, 'id="lobby-body"')
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        jobs.handler("test.ok")(lambda job, n: self._ok(job, n))
+        jobs.handler("test.boom")(lambda job: self._boom())
+        self.addCleanup(jobs._handlers.pop, "test.ok")
+        self.addCleanup(jobs._handlers.pop, "test.boom")
+
+    def _ok(self, job, n):
+        self.calls.append(n)
+        jobs.report(job, 50, "half way")
+        return {"n": n}
+
+    def _boom(self):
+        raise RuntimeError("boom")
+
+    def test_claim_takes_oldest_due_job_once(self):
+        later = jobs.enqueue("test.ok", delay=60, n=0)
+        first = jobs.enqueue("test.ok", n=1)
+        second = jobs.enqueue("test.ok", n=2)
+
+        claimed = jobs.claim("w1")
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual((claimed.status, claimed.worker, claimed.attempts), (Job.RUNNING, "w1", 1))
+        self.assertEqual(jobs.claim("w2").pk, second.pk)
+        self.assertIsNone(jobs.claim("w3"))  # the delayed job is not due yet
+        self.assertEqual(Job.objects.get(pk=later.pk).status, Job.QUEUED)
+
+    def test_run_records_result(self):
+        job = jobs.enqueue("test.ok", n=7)
+        self.assertTrue(jobs.run(jobs.claim("w")))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress, job.result), (Job.DONE, 100, {"n": 7}))
+        self.assertEqual(self.calls, [7])
+        self.assertIsNotNone(job.finished_at)
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        job = jobs.enqueue("test.boom")
+        for attempt in range(1, jobs.MAX_ATTEMPTS + 1):
+            before = timezone.now()
+            with self.assertLogs("main_app.jobs", "ERROR"):
+                self.assertFalse(jobs.run(jobs.claim("w")))
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+            self.assertEqual(job.message, "boom")
+            if attempt < jobs.MAX_ATTEMPTS:
+                self.assertEqual(job.status, Job.QUEUED)
+                delay = timedelta(seconds=jobs.RETRY_DELAY * 2 ** (attempt - 1))
+                self.assertGreaterEqual(job.run_after, before + delay)
+                self.assertIsNone(jobs.claim("w"))  # not due before the delay
+                Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("RuntimeError", job.error)
+
+    def test_unknown_kind_fails_without_retry(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue("test.missing")
+        job = Job.objects.create(kind="test.missing")
+        with self.assertLogs("main_app.jobs", "ERROR"):
+            self.assertFalse(jobs.run(jobs.claim("w")))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_stale_running_jobs_are_requeued_or_failed(self):
+        stale = jobs.enqueue("test.ok", n=1)
+        spent = jobs.enqueue("test.ok", n=2)
+        alive = jobs.enqueue("test.ok", n=3)
+        for _ in range(3):
+            jobs.claim("w")
+        old = timezone.now() - timedelta(seconds=jobs.STALE_AFTER + 1)
+        Job.objects.filter(pk__in=[stale.pk, spent.pk]).update(heartbeat_at=old)
+        Job.objects.filter(pk=spent.pk).update(attempts=jobs.MAX_ATTEMPTS)
+
+        self.assertEqual(jobs.requeue_stale(), 2)
+        statuses = dict(Job.objects.values_list("pk", "status"))
+        self.assertEqual(
+            [statuses[stale.pk], statuses[spent.pk], statuses[alive.pk]], [Job.QUEUED, Job.FAILED, Job.RUNNING]
+        )
+        self.assertEqual(jobs.claim("w2").pk, stale.pk)
@@ -29,6 +29,7 @@ urlpatterns = [
     path("courses/create/", views.course_create, name="course_create"),
     path("courses/join/", views.course_join, name="course_join"),   # ← added
     path("courses/<int:pk>/", views.course_detail, name="course_detail"),
+    path("courses/<int:pk>/gradebook/<str:fmt>/", views.course_gradebook, name="course_gradebook"),
 
     # Quizzes
     path("quizzes/", views.quiz_list, name="quiz_list"),
@@ -50,7 +51,14 @@ urlpatterns = [
     path("live/session/<int:pk>/play/", views.livesession_play, name="livesession_play"),
     path("live/join/", views.livesession_join, name="livesession_join"),
     path("live/session/<int:pk>/status/", views.livesession_status, name="livesession_status"),
+    path("live/session/<int:pk>/leaderboard/", views.livesession_leaderboard, name="livesession_leaderboard"),
     path("live/session/<int:pk>/answers/", views.livesession_answers, name="livesession_answers"),
+    path("live/session/<int:pk>/export/<str:fmt>/", views.livesession_export, name="livesession_export"),
+    path("live/session/<int:pk>/export/<str:fmt>/job/", views.livesession_export_job, name="livesession_export_job"),
+
+    # Background jobs
+    path("jobs/<int:pk>/", views.job_status, name="job_status"),
+    path("jobs/<int:pk>/download/", views.job_download, name="job_download"),
 
 ]
 
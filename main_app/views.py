@@ -4,9 +4,10 @@ from django.contrib.auth import get_user_model, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LoginView, LogoutView
 from django.db import transaction
-from django.db.models import Count, Q, F
-from django.http import HttpResponseForbidden, JsonResponse
+from django.db.models import Count, Q
+from django.http import FileResponse, Http404, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
 from django.views.generic import ListView
 import os
@@ -15,8 +16,11 @@ from django.utils.crypto import get_random_string
 from django.db.utils import OperationalError, ProgrammingError
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from .models import _short_code
-CourseMember = None
+from . import answer_key, exports, gradebook, jobs, live_state, ongoing, reports, roster, stats
+from .leaderboard import (
+    TOP_N as LEADERBOARD_TOP_N, board_size, ensure_final, final_board, freeze as freeze_leaderboard,
+    final_rows as final_leaderboard_rows, full_rows as full_leaderboard_rows, live_board,
+)
 from django.db.models import Prefetch
 from django.contrib import messages
 
@@ -46,12 +50,16 @@ from .models import (
     OrgMembership,
     Course,
     Quiz,
+    CourseEnrollment,
     LiveSession,
     LiveParticipant,
-    LiveLeaderboard,
+    LiveAnswer,
+    LiveJoinCode,
+    Job,
 )
 from .permissions import (
     allowed,
+    memberships,
     ORG,
     MEMBERSHIP,
     COURSE,
@@ -70,24 +78,28 @@ User = get_user_model()
 # --------------------
 # Home / Auth
 # --------------------
+def _home_stats():
+    return stats.count_all(
+        organizations=Organization.objects.all(),
+        users=User.objects.all(),
+        teachers=OrgMembership.objects.filter(role=ROLE_TEACHER),
+        students=OrgMembership.objects.filter(role=ROLE_STUDENT),
+        courses=Course.objects.all(),
+        quizzes=Quiz.objects.all(),
+        live_total=LiveSession.objects.all(),
+        live_active=LiveSession.objects.filter(ended_at__isnull=True),
+    )
+
+
 def home(request):
     if request.user.is_authenticated:
         return redirect("/dashboard/")
 
-    # Safe stats (avoid 500 before migrate)
+    # Safe stats (avoid 500 before migrate); cached until a counted model changes
     try:
-        stats = {
-            "organizations": Organization.objects.count(),
-            "users": User.objects.count(),
-            "teachers": OrgMembership.objects.filter(role=ROLE_TEACHER).count(),
-            "students": OrgMembership.objects.filter(role=ROLE_STUDENT).count(),
-            "courses": Course.objects.count(),
-            "quizzes": Quiz.objects.count(),
-            "live_total": LiveSession.objects.count(),
-            "live_active": LiveSession.objects.filter(ended_at__isnull=True).count(),
-        }
+        home_stats = stats.cached("home", _home_stats)
     except (OperationalError, ProgrammingError):
-        stats = {
+        home_stats = {
             "organizations": 0,
             "users": 0,
             "teachers": 0,
@@ -98,7 +110,7 @@ def home(request):
             "live_active": 0,
         }
 
-    return render(request, "home.html", {"stats": stats})
+    return render(request, "home.html", {"stats": home_stats})
 
 
 def signup(request):
@@ -152,7 +164,7 @@ class SignOutView(LogoutView):
 def _actor_role_and_org(user):
     if user.is_superuser:
         return ROLE_SUPERUSER, None
-    m = OrgMembership.objects.select_related("organization").filter(user=user).first()
+    m = memberships(user).primary
     if not m:
         return None, None
     return m.role, m.organization
@@ -188,13 +200,28 @@ def _course_group_send(course_id: int, payload: dict):
     )
 
 
-def _live_update_send(session_id: int, payload: dict):
-    """Send a state update to everyone on the live session page (and the host’s detail page)."""
+def _announce_session(session, op: str):
+    """Course page and org dashboards: a session was created, updated or ended ("remove")."""
+    if op == "remove":
+        _course_group_send(session.quiz.course_id, {"op": op, "session": {"id": session.id}})
+    else:
+        _course_group_send(session.quiz.course_id, {"op": op, "session": _serialize_session_for_course(session)})
+    ongoing.publish(session, op)
+
+
+def _live_update_send(session_id: int, payload: dict, event: dict | None = None):
+    """
+    Send a state update to everyone on the live session page (and the host’s detail page).
+
+    With an event, both travel in one "session.message" so the transition is a
+    single fan-out; each socket still receives an "update" then an "event" frame.
+    """
     channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"live_{session_id}",
-        {"type": "session.update", "payload": payload},
-    )
+    if event is None:
+        message = {"type": "session.update", "payload": payload}
+    else:
+        message = {"type": "session.message", "update": payload, "event": event}
+    async_to_sync(channel_layer.group_send)(f"live_{session_id}", message)
 
 
 def _live_event_send(session_id: int, payload: dict):
@@ -206,63 +233,24 @@ def _live_event_send(session_id: int, payload: dict):
     )
 
 
-def _participants_rows_for_ws(session: LiveSession):
-    """Participants for the table JS (excluding host)."""
-    return list(
-        LiveParticipant.objects.select_related("user")
-        .filter(livesession=session)
-        .exclude(user_id=session.host_id)
-        .annotate(
-            username=F("user__username"),
-            first_name=F("user__first_name"),
-            last_name=F("user__last_name"),
-            email=F("user__email"),
+def _roster_send(state, changes: dict | None):
+    """Send a roster change as a delta (see roster.py) to the session's host/staff sockets."""
+    delta = roster.delta(state, **changes) if changes else None
+    if delta:
+        async_to_sync(get_channel_layer().group_send)(
+            roster.staff_group(state.session_id),
+            {"type": "session.update", "payload": {"roster": delta}},
         )
-        .values("user_id", "username", "first_name", "last_name", "email")
-    )
 
 
-def _lobby_users_rows_for_ws(session: LiveSession):
-    """Lobby users with fields expected by the table JS, preserving order."""
-    ids = list((session.details or {}).get("lobby", []))
-    if not ids:
-        return []
-    by_id = {
-        u["id"]: u
-        for u in User.objects.filter(id__in=ids).values("id", "username", "first_name", "last_name", "email")
-    }
-    return [by_id[i] for i in ids if i in by_id]
-
-
-def _leaderboard_rows_for_ws(session: LiveSession):
-    """Leaderboard rows with fields expected by the table JS."""
-    return list(
-        LiveLeaderboard.objects.select_related("participant", "participant__user")
-        .filter(livesession=session)
-        .order_by("rank")
-        .values(
-            "rank",
-            "score",
-            username=F("participant__user__username"),
-            first_name=F("participant__user__first_name"),
-            last_name=F("participant__user__last_name"),
-        )
+def _live_end_send(session: LiveSession):
+    """Session ended: every socket gets the shared top-N and adds its own standing."""
+    async_to_sync(get_channel_layer().group_send)(
+        f"live_{session.id}",
+        {"type": "session.ended", "payload": final_board(session).payload()},
     )
 
 
-def _compute_runtime_leaderboard(session: LiveSession):
-    rows = []
-    qs = LiveParticipant.objects.select_related("user").filter(livesession=session)
-    for p in qs:
-        answers = p.answer_questions or []
-        score = sum(int(a.get("points", 0)) for a in answers)
-        rows.append({"participant": p, "score": score})
-    rows.sort(key=lambda r: r["score"], reverse=True)
-    for i, r in enumerate(rows, start=1):
-        r["rank"] = i
-    return rows
-
-
 def _ensure_can_edit_quiz(request, quiz: Quiz):
     role, _ = _actor_role_and_org(request.user)
     if role is None:
@@ -306,6 +294,81 @@ def _save_uploaded_image(file) -> str:
 # --------------------
 # Dashboard
 # --------------------
+def _ongoing_lines(user, with_host=False):
+    """Dashboard "ongoing sessions" list, read from the in-memory index (no query)."""
+    scope = ongoing.scope_for(user)
+    if scope is None:
+        return []
+    rows = ongoing.snapshot(scope, limit=12)
+    if with_host:
+        return [f"#{r['id']} — {r['quiz_title']} — {r['course_name']} — host: {r['host_name']}" for r in rows]
+    return [f"#{r['id']} — {r['quiz_title']} — {r['course_name']}" for r in rows]
+
+
+def _dashboard_superuser():
+    counts = stats.count_all(
+        ORGANIZATIONS=Organization.objects.all(),
+        USERS=User.objects.all(),
+        COURSES=Course.objects.all(),
+        QUIZZES=Quiz.objects.all(),
+        TEACHERS=OrgMembership.objects.filter(role=ROLE_TEACHER),
+        LIVE_SESSIONS=LiveSession.objects.filter(ended_at__isnull=True),
+        STUDENTS=OrgMembership.objects.filter(role=ROLE_STUDENT),
+    )
+    org_rollups = Organization.objects.order_by("name").annotate(
+        members=Count("memberships"),
+        teachers=Count("memberships", filter=Q(memberships__role=ROLE_TEACHER)),
+        students=Count("memberships", filter=Q(memberships__role=ROLE_STUDENT)),
+    )
+    lists = {
+        "Org members": [],
+        "Teachers per organization": [],
+        "Students per organization": [],
+    }
+    for o in org_rollups:
+        lists["Org members"].append(f"{o.name} — {o.members}")
+        lists["Teachers per organization"].append(f"{o.name} — {o.teachers}")
+        lists["Students per organization"].append(f"{o.name} — {o.students}")
+    return counts, lists
+
+
+def _dashboard_org(org):
+    members = OrgMembership.objects.filter(organization=org)
+    return stats.count_all(
+        ORG_MEMBERS=members,
+        COURSES=Course.objects.filter(organization=org),
+        QUIZZES=Quiz.objects.filter(course__organization=org),
+        TEACHERS=members.filter(role=ROLE_TEACHER),
+        LIVE_SESSIONS=LiveSession.objects.filter(quiz__course__organization=org, ended_at__isnull=True),
+        STUDENTS=members.filter(role=ROLE_STUDENT),
+    )
+
+
+def _dashboard_teacher(org, user):
+    courses = Course.objects.filter(organization=org, teacher=user)
+    counts = stats.count_all(
+        COURSES=courses,
+        QUIZZES=Quiz.objects.filter(course__organization=org, course__teacher=user),
+        LIVE_SESSIONS=LiveSession.objects.filter(quiz__course__organization=org, host=user, ended_at__isnull=True),
+    )
+    cards = {
+        "COURSES": counts["COURSES"],
+        "QUIZZES": counts["QUIZZES"],
+        "MY_QUIZZES": counts["QUIZZES"],
+        "LIVE_SESSIONS": counts["LIVE_SESSIONS"],
+    }
+    return cards, {"My_courses": [c.course_name for c in courses.order_by("course_name")[:12]]}
+
+
+def _dashboard_learner(courses_qs):
+    counts = stats.count_all(
+        COURSES=courses_qs,
+        QUIZZES=Quiz.objects.filter(course__in=courses_qs),
+        LIVE_SESSIONS=LiveSession.objects.filter(quiz__course__in=courses_qs, ended_at__isnull=True),
+    )
+    return counts, {"Courses": [c.course_name for c in courses_qs.order_by("course_name")[:12]]}
+
+
 @login_required
 def dashboard(request):
     user = request.user
@@ -313,56 +376,23 @@ def dashboard(request):
     if user.is_superuser:
         role, org = ROLE_SUPERUSER, None
     else:
-        mem = OrgMembership.objects.select_related("organization").filter(user=user).first()
+        mem = memberships(user).primary
         if not mem:
             return render(request, "main_app/dashboard_empty.html")
         role, org = mem.role, mem.organization
 
     ctx = {"role": role, "org": org, "title": "Dashboard"}
+    # Cards and lists are cached per (role, org[, user]) until a counted model changes;
+    # ongoing sessions come from the live index and are kept current over /ws/ongoing/
 
     # -------------------------
     # SUPERUSER (global)
     # -------------------------
     if role == ROLE_SUPERUSER:
         ctx["title"] = "Dashboard (Superuser)"
-
-        total_orgs = Organization.objects.count()
-        total_users = User.objects.count()
-        total_courses = Course.objects.count()
-        total_quizzes = Quiz.objects.count()
-        total_live_ongoing = LiveSession.objects.filter(ended_at__isnull=True).count()
-        total_teachers = OrgMembership.objects.filter(role=ROLE_TEACHER).count()
-        total_students = OrgMembership.objects.filter(role=ROLE_STUDENT).count()
-
-        org_rollups = Organization.objects.order_by("name").annotate(
-            members=Count("memberships"),
-            teachers=Count("memberships", filter=Q(memberships__role=ROLE_TEACHER)),
-            students=Count("memberships", filter=Q(memberships__role=ROLE_STUDENT)),
-        )
-
-        live_rows = (
-            LiveSession.objects.select_related("quiz", "host", "quiz__course", "quiz__course__organization")
-            .filter(ended_at__isnull=True)
-            .order_by("-id")[:12]
-        )
-        ctx["cards"] = {
-            "ORGANIZATIONS": total_orgs,
-            "USERS": total_users,
-            "COURSES": total_courses,
-            "QUIZZES": total_quizzes,
-            "TEACHERS": total_teachers,
-            "LIVE_SESSIONS": total_live_ongoing,
-            "STUDENTS": total_students,
-        }
-        ctx["lists"] = {
-            "Org members": [f"{o.name} — {o.members}" for o in org_rollups],
-            "Teachers per organization": [f"{o.name} — {o.teachers}" for o in org_rollups],
-            "Students per organization": [f"{o.name} — {o.students}" for o in org_rollups],
-            "Live_sessions_ongoing": [
-                f"#{s.id} — {s.quiz.quiz_title} — {s.quiz.course.course_name} — host: {(s.host.get_full_name() or s.host.username)}"
-                for s in live_rows
-            ],
-        }
+        cards, lists = stats.cached("dashboard", _dashboard_superuser, role)
+        ctx["cards"] = cards
+        ctx["lists"] = {**lists, "Live_sessions_ongoing": _ongoing_lines(user, with_host=True)}
         ctx["actions"] = {
             "create_orgmember_any_org": True,
             "manage_courses_global": True,
@@ -376,10 +406,8 @@ def dashboard(request):
     # -------------------------
     if role in {ROLE_ADMIN, ROLE_MANAGER}:
         ctx["title"] = f"Dashboard ({role.capitalize()})"
-
-        org_courses = Course.objects.filter(organization=org)
-        org_quizzes = Quiz.objects.filter(course__organization=org)
-        org_live_ongoing = LiveSession.objects.filter(quiz__course__organization=org, ended_at__isnull=True)
+        ctx["cards"] = stats.cached("dashboard", lambda: _dashboard_org(org), role, org.id)
+        ctx["lists"] = {"Live_sessions_ongoing": _ongoing_lines(user, with_host=True)}
 
         org_members_qs = (
             OrgMembership.objects.select_related("user")
@@ -393,35 +421,8 @@ def dashboard(request):
                 "user__last_name",
             )
         )
-
-        total_org_members = org_members_qs.count()
-        total_teachers = org_members_qs.filter(role=ROLE_TEACHER).count()
-        total_students = org_members_qs.filter(role=ROLE_STUDENT).count()
-
-        teachers_qs = org_members_qs.filter(role=ROLE_TEACHER).order_by("user__username")
-        students_qs = org_members_qs.filter(role=ROLE_STUDENT).order_by("user__username")
-
-        live_rows = (
-            org_live_ongoing.select_related("quiz", "host", "quiz__course")
-            .order_by("-id")[:12]
-        )
-
-        ctx["cards"] = {
-            "ORG_MEMBERS": total_org_members,
-            "COURSES": org_courses.count(),
-            "QUIZZES": org_quizzes.count(),
-            "TEACHERS": total_teachers,
-            "LIVE_SESSIONS": org_live_ongoing.count(),
-            "STUDENTS": total_students,
-        }
-        ctx["lists"] = {
-            "Live_sessions_ongoing": [
-                f"#{s.id} — {s.quiz.quiz_title} — {s.quiz.course.course_name} — host: {(s.host.get_full_name() or s.host.username)}"
-                for s in live_rows
-            ],
-        }
-        ctx["teachers"] = teachers_qs
-        ctx["students"] = students_qs
+        ctx["teachers"] = org_members_qs.filter(role=ROLE_TEACHER).order_by("user__username")
+        ctx["students"] = org_members_qs.filter(role=ROLE_STUDENT).order_by("user__username")
         ctx["actions"] = {
             "create_orgmember_this_org": True,
             "manage_courses": True,
@@ -434,33 +435,10 @@ def dashboard(request):
     # TEACHER
     # -------------------------
     if role == ROLE_TEACHER:
-        teacher_courses = Course.objects.filter(organization=org, teacher=user)
-        teacher_quizzes = Quiz.objects.filter(course__organization=org, course__teacher=user)
-        teacher_live_ongoing = LiveSession.objects.filter(
-            quiz__course__organization=org,
-            host=user,
-            ended_at__isnull=True
-        )
-
-        live_rows = (
-            teacher_live_ongoing.select_related("quiz", "quiz__course")
-            .order_by("-id")[:12]
-        )
-
         ctx["title"] = "Dashboard (Teacher)"
-        ctx["cards"] = {
-            "COURSES": teacher_courses.count(),
-            "QUIZZES": teacher_quizzes.count(),
-            "MY_QUIZZES": teacher_quizzes.count(),
-            "LIVE_SESSIONS": teacher_live_ongoing.count(),
-        }
-        ctx["lists"] = {
-            "My_courses": [c.course_name for c in teacher_courses.order_by("course_name")[:12]],
-            "Live_sessions_ongoing": [
-                f"#{s.id} — {s.quiz.quiz_title} — {s.quiz.course.course_name}"
-                for s in live_rows
-            ],
-        }
+        cards, lists = stats.cached("dashboard", lambda: _dashboard_teacher(org, user), role, org.id, user.id)
+        ctx["cards"] = cards
+        ctx["lists"] = {**lists, "Live_sessions_ongoing": _ongoing_lines(user)}
         ctx["actions"] = {"manage_quizzes": True, "manage_lives": True}
         return render(request, "main_app/dashboard.html", ctx)
 
@@ -468,35 +446,12 @@ def dashboard(request):
     # STUDENT
     # -------------------------
     if role == ROLE_STUDENT:
-        # Prefer enrolled courses if you have CourseMember
-        if CourseMember is not None:
-            enrolled = CourseMember.objects.select_related("course").filter(
-                user=user, course__organization=org
-            )
-            courses_qs = Course.objects.filter(id__in=enrolled.values("course_id"))
-        else:
-            # Fallback: show all org courses (if you don't track enrollment)
-            courses_qs = Course.objects.filter(organization=org)
-
-        quizzes_qs = Quiz.objects.filter(course__in=courses_qs)
-        live_ongoing_qs = LiveSession.objects.filter(
-            quiz__course__in=courses_qs,
-            ended_at__isnull=True
-        )
+        courses_qs = Course.objects.filter(organization=org, enrollments__user=user)
 
         ctx["title"] = "Dashboard (Student)"
-        ctx["cards"] = {
-            "COURSES": courses_qs.count(),
-            "QUIZZES": quizzes_qs.count(),
-            "LIVE_SESSIONS": live_ongoing_qs.count(),
-        }
-        ctx["lists"] = {
-            "Courses": [c.course_name for c in courses_qs.order_by("course_name")[:12]],
-            "Live_sessions_ongoing": [
-                f"#{s.id} — {s.quiz.quiz_title} — {s.quiz.course.course_name}"
-                for s in live_ongoing_qs.select_related("quiz", "quiz__course").order_by("-id")[:12]
-            ],
-        }
+        cards, lists = stats.cached("dashboard", lambda: _dashboard_learner(courses_qs), role, org.id, user.id)
+        ctx["cards"] = cards
+        ctx["lists"] = {**lists, "Live_sessions_ongoing": _ongoing_lines(user)}
         ctx["actions"] = {}
         return render(request, "main_app/dashboard.html", ctx)
 
@@ -506,22 +461,14 @@ def dashboard(request):
     if role == ROLE_PARENTS:
         # If you later model parent->child relations, scope these to the child’s courses.
         courses_qs = Course.objects.filter(organization=org)
-        quizzes_qs = Quiz.objects.filter(course__organization=org)
-        live_ongoing_qs = LiveSession.objects.filter(quiz__course__organization=org, ended_at__isnull=True)
 
         ctx["title"] = "Dashboard (Parents)"
-        ctx["cards"] = {
-            "COURSES": courses_qs.count(),
-            "QUIZZES": quizzes_qs.count(),
-            "LIVE_SESSIONS": live_ongoing_qs.count(),
-        }
+        cards, lists = stats.cached("dashboard", lambda: _dashboard_learner(courses_qs), role, org.id)
+        ctx["cards"] = cards
+        # keep your extra sections for badges/xp if you later populate them
         ctx["lists"] = {
-            "Courses": [c.course_name for c in courses_qs.order_by("course_name")[:12]],
-            "Live_sessions_ongoing": [
-                f"#{s.id} — {s.quiz.quiz_title} — {s.quiz.course.course_name}"
-                for s in live_ongoing_qs.select_related("quiz", "quiz__course").order_by("-id")[:12]
-            ],
-            # keep your extra sections for badges/xp if you later populate them
+            **lists,
+            "Live_sessions_ongoing": _ongoing_lines(user),
             "Children_badges": [],
             "Children_xp": [],
         }
@@ -541,7 +488,7 @@ def orgmember_create(request):
     if request.user.is_superuser:
         actor_role, actor_org = ROLE_SUPERUSER, None
     else:
-        m = OrgMembership.objects.select_related("organization").filter(user=request.user).first()
+        m = memberships(request.user).primary
         if not m:
             messages.error(request, "You are not in any organization.")
             return redirect("/dashboard/")
@@ -677,6 +624,10 @@ class OrganizationListView(ListView):
 # --------------------
 # Courses
 # --------------------
+def _is_enrolled(user, course_id) -> bool:
+    return CourseEnrollment.objects.filter(course_id=course_id, user=user).exists()
+
+
 @login_required
 def course_list(request):
     role, org = _actor_role_and_org(request.user)
@@ -694,7 +645,9 @@ def course_list(request):
         elif role == ROLE_TEACHER:
             qs = base.filter(teacher=request.user)
         else:
-            qs = [c for c in base if request.user.id in (c.enrolled_students or [])]
+            # id__in keeps the enrollment filter off the join the count below uses
+            qs = base.filter(id__in=CourseEnrollment.objects.filter(user=request.user).values("course_id"))
+    qs = qs.annotate(enrolled_count=Count("enrollments"))
 
     can_create = allowed(request.user, CREATE, COURSE, org=org)
     return render(
@@ -724,7 +677,6 @@ def course_create(request):
                     course_name=form.cleaned_data["course_name"],
                     join_code=form.cleaned_data["join_code"],
                     subject_category=form.cleaned_data["subject_category"],
-                    enrolled_students=[],
                 )
             messages.success(request, "Course created.")
             return redirect("course_detail", pk=course.pk)
@@ -743,7 +695,7 @@ def course_detail(request, pk: int):
         return render(request, "403.html", status=403)
     if role == ROLE_TEACHER and course.teacher_id != request.user.id:
         return render(request, "403.html", status=403)
-    if role in {ROLE_STUDENT, ROLE_PARENTS} and request.user.id not in (course.enrolled_students or []):
+    if role in {ROLE_STUDENT, ROLE_PARENTS} and not _is_enrolled(request.user, course.id):
         return render(request, "403.html", status=403)
 
     # Keep realtime table (ongoing only) for the top section
@@ -806,11 +758,8 @@ def course_join(request):
                 messages.error(request, "You can only join courses in your organization.")
                 return render(request, "main_app/course_join.html", {"form": form})
 
-            enrolled = list(course.enrolled_students or [])
-            if request.user.id not in enrolled:
-                enrolled.append(request.user.id)
-                course.enrolled_students = enrolled
-                course.save(update_fields=["enrolled_students"])
+            # unique (course, user): concurrent joins each insert one row
+            CourseEnrollment.objects.get_or_create(course=course, user=request.user)
 
             messages.success(request, f"You joined {course.course_name}.")
             return redirect("course_detail", pk=course.pk)
@@ -842,9 +791,7 @@ def quiz_list(request):
         elif role == ROLE_TEACHER:
             qs = base.filter(course__teacher=request.user)
         else:
-            courses = Course.objects.filter(organization=org).select_related("teacher")
-            joined = [c.id for c in courses if request.user.id in (c.enrolled_students or [])]
-            qs = base.filter(course_id__in=joined)
+            qs = base.filter(course__enrollments__user=request.user)
 
     can_create = allowed(request.user, CREATE, QUIZ, org=org)
     return render(
@@ -863,7 +810,7 @@ def quiz_detail(request, pk: int):
         return render(request, "403.html", status=403)
     if role == ROLE_TEACHER and quiz.course.teacher_id != request.user.id:
         return render(request, "403.html", status=403)
-    if role in {ROLE_STUDENT, ROLE_PARENTS} and request.user.id not in (quiz.course.enrolled_students or []):
+    if role in {ROLE_STUDENT, ROLE_PARENTS} and not _is_enrolled(request.user, quiz.course_id):
         return render(request, "403.html", status=403)
 
     can_edit = allowed(request.user, UPDATE_ONE, QUIZ, org=quiz.course.organization) and (
@@ -1133,58 +1080,42 @@ def quiz_question_move(request, pk: int, qindex: int, direction: str):
 # --------------------
 # Live Sessions
 # --------------------
-POINTS_PER_QUESTION = 10
-
-
 def _quiz_questions(session: LiveSession):
     return _get_content_list(session.quiz)
 
 
-def _get_idx_and_total(session: LiveSession):
-    d = session.details or {}
-    return int(d.get("current_index", -1)), int(d.get("total_questions", 0))
-
-
-def _set_idx_and_total(session: LiveSession, idx: int, total: int):
-    d = dict(session.details or {})
-    d["current_index"] = idx
-    d["total_questions"] = total
-    session.details = d
-    session.save(update_fields=["details"])
-
-
-def _recompute_leaderboard(session: LiveSession):
-    rows = []
-    for p in LiveParticipant.objects.filter(livesession=session).only("id", "answer_questions", "user_id"):
-        answers = p.answer_questions or []
-        score = sum(int(a.get("points", 0)) for a in answers)
-        rows.append((p, score))
-
-    rows.sort(key=lambda t: t[1], reverse=True)
-
-    LiveLeaderboard.objects.filter(livesession=session).delete()
-    rank = 1
-    for p, score in rows:
-        LiveLeaderboard.objects.create(livesession=session, participant=p, rank=rank, score=score)
-        rank += 1
-
+def _question_payload(session: LiveSession, idx: int, total: int):
+    """Client-safe question (no is_correct flags), serialised once per transition."""
+    questions = _quiz_questions(session)
+    if not (0 <= idx < len(questions)):
+        return None
+    q = questions[idx]
+    return {
+        "index": idx,
+        "total": total,
+        "question": q["question"],
+        "question_type": q["question_type"],
+        "image": q["image"],
+        "choices": [ch.get("text") or "" for ch in q["choices"]],
+    }
 
-def _evaluate(question: dict, selected_indexes: list[int]) -> int:
-    qtype = (question.get("question_type") or "").upper()
-    choices = question.get("choices") or []
-    try:
-        sel = {int(i) for i in selected_indexes}
-    except Exception:
-        sel = set()
 
-    correct = {i for i, ch in enumerate(choices) if bool(ch.get("is_correct"))}
+def _end_live_session(session: LiveSession, state: live_state.LiveState):
+    """Mark ended, flush the shared state and freeze the final board; its rows are written by a job."""
+    state.end()
+    live_state.touch(state)
+    session.ended_at = state.ended_at
+    freeze_leaderboard(session)
+    jobs.enqueue("live.finalise", session_id=session.pk)
+    live_state.discard(session.pk)
 
-    if qtype == "MSQ":
-        return POINTS_PER_QUESTION if (sel == correct) else 0
 
-    if len(sel) != 1:
-        return 0
-    return POINTS_PER_QUESTION if (next(iter(sel)) in correct) else 0
+def _ended_leaderboard(session: LiveSession, user, is_host: bool):
+    """Final rows to render and the viewer's own line: the host sees the whole board."""
+    rows = final_leaderboard_rows(session)
+    if is_host:
+        return rows, None
+    return rows[:LEADERBOARD_TOP_N], final_board(session).standing(user.id)
 
 
 @login_required
@@ -1197,21 +1128,11 @@ def livesession_create(request, quiz_id: int):
     if role == ROLE_TEACHER and quiz.course.teacher_id != request.user.id:
         return render(request, "403.html", status=403)
 
-    session = LiveSession.objects.create(
-        quiz=quiz,
-        host=request.user,
-        details={"join_code": _short_code(), "lobby": []},
-    )
-
-    # Ensure join code exists (defensive)
-    d = dict(session.details or {})
-    if not d.get("join_code"):
-        d["join_code"] = _short_code()
-        session.details = d
-        session.save(update_fields=["details"])
+    session = LiveSession.objects.create(quiz=quiz, host=request.user)
+    session.regenerate_join_code()
 
-    # Realtime: show it on the course page immediately
-    _course_group_send(quiz.course_id, {"op": "create", "session": _serialize_session_for_course(session)})
+    # Realtime: show it on the course page and dashboards immediately
+    _announce_session(session, "create")
 
     messages.success(request, "Live session created.")
     return redirect("livesession_detail", pk=session.pk)
@@ -1233,128 +1154,112 @@ def livesession_detail(request, pk: int):
 
     is_host = request.user.id == session.host_id
     questions = _quiz_questions(session)
+    state = live_state.get_state(session)
+    state.apply_to(session)
 
     if request.method == "POST" and is_host:
         action = request.POST.get("action", "")
 
-        if action == "regenerate_code" and not session.started_at and not session.ended_at:
-            d = dict(session.details or {})
-            d["join_code"] = _short_code()
-            session.details = d
-            session.save(update_fields=["details"])
+        if action == "regenerate_code" and not state.started and not state.ended:
+            state.set_join_code(LiveJoinCode.assign(session))
+            live_state.touch(state)
+            session.details = state.details()
 
-            # Course page: update join code
-            _course_group_send(session.quiz.course_id, {"op": "update", "session": _serialize_session_for_course(session)})
+            # Course page + dashboards: update join code
+            _announce_session(session, "update")
 
             messages.success(request, "Join code regenerated.")
             return redirect("livesession_detail", pk=session.pk)
 
-        if action == "start" and session.started_at is None:
-            session.started_at = timezone.now()
-            lobby = list((session.details or {}).get("lobby", []))
-            for uid in lobby:
-                LiveParticipant.objects.get_or_create(livesession=session, user_id=uid)
-            d = dict(session.details or {})
-            d["lobby"] = []
-            session.details = d
-            session.save(update_fields=["started_at", "details"])
-            _set_idx_and_total(session, idx=0 if questions else -1, total=len(questions))
-            idx, total = _get_idx_and_total(session)
-
-            # Live page: flip to started, clear lobby, refresh participants
+        if action == "start" and not state.started:
+            changes = roster.start(state, total=len(questions))
+            live_state.touch(state)
+            session.started_at = state.started_at
+            idx, total = state.idx_and_total()
+
+            # Live page: move the lobby into participants (staff), flip to started (everyone)
+            _roster_send(state, changes)
             _live_update_send(session.id, {
                 "started": True,
                 "current_index": idx,
                 "total": total,
-                "lobby_users": [],
-                "participants": _participants_rows_for_ws(session),
-            })
-            _live_event_send(session.id, {"kind": "started"})
+                "question": _question_payload(session, idx, total),
+            }, event={"kind": "started"})
 
-            # Course page: update started_at column
-            _course_group_send(session.quiz.course_id, {"op": "update", "session": _serialize_session_for_course(session)})
+            # Course page + dashboards: update started_at
+            _announce_session(session, "update")
 
             return redirect("livesession_play", pk=session.pk)
 
-        if action == "end" and session.ended_at is None:
-            session.ended_at = timezone.now()
-            session.save(update_fields=["ended_at"])
-            _recompute_leaderboard(session)
+        if action == "end" and not state.ended:
+            _end_live_session(session, state)
 
             # Live page: ended + leaderboard
-            _live_update_send(session.id, {"ended": True, "leaderboard": _leaderboard_rows_for_ws(session)})
-            # Course page: remove from list
-            _course_group_send(session.quiz.course_id, {"op": "remove", "session": {"id": session.id}})
+            _live_end_send(session)
+            # Course page + dashboards: remove from list
+            _announce_session(session, "remove")
 
             messages.success(request, "Session ended.")
             return redirect("livesession_detail", pk=session.pk)
 
-        if action == "next" and session.started_at and not session.ended_at:
-            idx, total = _get_idx_and_total(session)
-            if 0 <= idx < total - 1:
-                _set_idx_and_total(session, idx=idx + 1, total=total)
+        if action == "next" and state.started and not state.ended:
+            if state.advance():
+                live_state.touch(state)
+                idx, total = state.idx_and_total()
                 # Live page: question changed
-                _live_update_send(session.id, {"current_index": idx + 1, "total": total})
-                _live_event_send(session.id, {"kind": "question_changed"})
+                _live_update_send(session.id, {
+                    "current_index": idx,
+                    "total": total,
+                    "question": _question_payload(session, idx, total),
+                }, event={"kind": "question_changed"})
                 messages.success(request, "Next question.")
             else:
-                session.ended_at = timezone.now()
-                session.save(update_fields=["ended_at"])
-                _recompute_leaderboard(session)
+                _end_live_session(session, state)
 
-                _live_update_send(session.id, {"ended": True, "leaderboard": _leaderboard_rows_for_ws(session)})
-                _course_group_send(session.quiz.course_id, {"op": "remove", "session": {"id": session.id}})
+                _live_end_send(session)
+                _announce_session(session, "remove")
 
                 messages.success(request, "No more questions. Session ended.")
             return redirect("livesession_detail", pk=session.pk)
 
-        if action == "admit_user_id" and not session.started_at and not session.ended_at:
+        if action == "admit_user_id" and not state.started and not state.ended:
             try:
                 uid = int(request.POST.get("user_id"))
             except (TypeError, ValueError):
                 uid = None
-            if uid:
-                d = dict(session.details or {})
-                lobby = set(d.get("lobby", []))
-                if uid in lobby:
-                    lobby.remove(uid)
-                    d["lobby"] = list(lobby)
-                    session.details = d
-                    session.save(update_fields=["details"])
-                LiveParticipant.objects.get_or_create(livesession=session, user_id=uid)
-
-                # Live page: refresh lobby + participants
-                _live_update_send(session.id, {
-                    "lobby_users": _lobby_users_rows_for_ws(session),
-                    "participants": _participants_rows_for_ws(session),
-                })
+            changes = roster.admit_waiting(state, uid) if uid else {}
+            if changes:
+                live_state.touch(state)
+
+                # Live page: move the user from lobby to participants, tell them they're in
+                _roster_send(state, changes)
                 _live_event_send(session.id, {"kind": "admitted", "user_id": uid})
 
                 messages.success(request, "Participant admitted.")
+            else:
+                messages.error(request, "That user is not waiting in the lobby.")
             return redirect("livesession_detail", pk=session.pk)
 
-    lobby_ids = list((session.details or {}).get("lobby", []))
-    lobby_users = list(User.objects.filter(id__in=lobby_ids).order_by("username"))
-    participants = (
-        LiveParticipant.objects.select_related("user")
-        .filter(livesession=session)
-        .order_by("user__username")
-    )
-
-    if session.ended_at:
-        _recompute_leaderboard(session)
-        leaderboard = (
-            LiveLeaderboard.objects.select_related("participant", "participant__user")
+    # Names and emails are for staff only (as with the socket rosters)
+    show_roster = roster.is_staff(request.user, role, session)
+    lobby_users, participants = [], []
+    if show_roster:
+        with state.lock:
+            lobby_ids = list(state.lobby)
+        lobby_users = list(User.objects.filter(id__in=lobby_ids).order_by("username"))
+        participants = (
+            LiveParticipant.objects.select_related("user")
+            .defer("answer_questions")
             .filter(livesession=session)
-            .order_by("rank")
+            .order_by("user__username")
         )
+
+    my_standing = None
+    if state.ended:
+        leaderboard, my_standing = _ended_leaderboard(session, request.user, is_host)
     else:
-        temp = []
-        for p in participants:
-            score = sum(int(a.get("points", 0)) for a in (p.answer_questions or []))
-            temp.append((p, score))
-        temp.sort(key=lambda t: t[1], reverse=True)
-        leaderboard = [{"rank": i + 1, "participant": p, "score": s} for i, (p, s) in enumerate(temp)]
+        # running: the host's top K straight from the Ranking; the WS stream keeps it fresh
+        leaderboard = live_board(state.ranking)["rows"] if is_host else []
 
     return render(
         request,
@@ -1362,9 +1267,11 @@ def livesession_detail(request, pk: int):
         {
             "session": session,
             "is_host": is_host,
+            "show_roster": show_roster,
             "lobby_users": lobby_users,
             "participants": participants,
             "leaderboard": leaderboard,
+            "my_standing": my_standing,
         },
     )
 
@@ -1380,44 +1287,43 @@ def livesession_play(request, pk: int):
         return render(request, "403.html", status=403)
 
     questions = _quiz_questions(session)
-    idx, total = _get_idx_and_total(session)
+    state = live_state.get_state(session)
+    state.apply_to(session)
+    idx, total = state.idx_and_total()
     is_host = request.user.id == session.host_id
 
-    if session.started_at is None and session.ended_at is None:
+    if not state.started and not state.ended:
         return render(request, "main_app/play.html", {"session": session, "state": "waiting", "is_host": is_host})
 
-    if session.ended_at is not None:
-        _recompute_leaderboard(session)
-        board = (
-            LiveLeaderboard.objects.select_related("participant", "participant__user")
-            .filter(livesession=session)
-            .order_by("rank")
-        )
+    if state.ended:
+        board, me = _ended_leaderboard(session, request.user, is_host)
         return render(
             request,
             "main_app/play.html",
-            {"session": session, "state": "ended", "leaderboard": board, "is_host": is_host},
+            {"session": session, "state": "ended", "leaderboard": board, "my_standing": me, "is_host": is_host},
         )
 
     if not (0 <= idx < total):
-        session.ended_at = timezone.now()
-        session.save(update_fields=["ended_at"])
-        _recompute_leaderboard(session)
-        board = (
-            LiveLeaderboard.objects.select_related("participant", "participant__user")
-            .filter(livesession=session)
-            .order_by("rank")
-        )
+        _end_live_session(session, state)
+        _live_end_send(session)
+        _announce_session(session, "remove")
+        board, me = _ended_leaderboard(session, request.user, is_host)
         return render(
             request,
             "main_app/play.html",
-            {"session": session, "state": "ended", "leaderboard": board, "is_host": is_host},
+            {"session": session, "state": "ended", "leaderboard": board, "my_standing": me, "is_host": is_host},
         )
 
     question = questions[idx]
 
     if not is_host:
-        lp, _ = LiveParticipant.objects.get_or_create(livesession=session, user=request.user)
+        lp, created = LiveParticipant.objects.defer("answer_questions").get_or_create(livesession=session, user=request.user)
+        if created:
+            # opened the play page directly: register with the live roster too
+            changes = roster.admit(state, request.user.id)
+            if changes:
+                live_state.touch(state)
+                _roster_send(state, changes)
     else:
         lp = None
 
@@ -1425,53 +1331,42 @@ def livesession_play(request, pk: int):
         action = request.POST.get("action")
 
         if is_host and action == "next":
-            if idx < total - 1:
-                _set_idx_and_total(session, idx=idx + 1, total=total)
+            if state.advance():
+                live_state.touch(state)
                 # Live WS: everyone advances without refresh
-                _live_update_send(session.id, {"current_index": idx + 1, "total": total})
-                _live_event_send(session.id, {"kind": "question_changed"})
+                _live_update_send(session.id, {
+                    "current_index": state.current_index,
+                    "total": total,
+                    "question": _question_payload(session, state.current_index, total),
+                }, event={"kind": "question_changed"})
                 messages.success(request, "Next question.")
             else:
-                session.ended_at = timezone.now()
-                session.save(update_fields=["ended_at"])
-                _recompute_leaderboard(session)
+                _end_live_session(session, state)
 
-                # Live WS + Course WS
-                _live_update_send(session.id, {"ended": True, "leaderboard": _leaderboard_rows_for_ws(session)})
-                _course_group_send(session.quiz.course_id, {"op": "remove", "session": {"id": session.id}})
+                # Live WS + Course WS + dashboards
+                _live_end_send(session)
+                _announce_session(session, "remove")
 
                 messages.success(request, "Session ended.")
             return redirect("livesession_play", pk=session.pk)
 
         if action == "answer" and lp:
-            answers = list(lp.answer_questions or [])
-            already = any(int(a.get("question_id", -999)) == idx for a in answers)
-            if not already:
-                selected_raw = request.POST.getlist("choice")
-                try:
-                    sel_ints = [int(s) for s in selected_raw]
-                except Exception:
-                    sel_ints = []
-                points = _evaluate(question, sel_ints)
-                answers.append({"question_id": idx, "points": points, "selected": sel_ints})
-                lp.answer_questions = answers
-                lp.save(update_fields=["answer_questions"])
+            sel_ints = answer_key.parse_selected(request.POST.getlist("choice"))
+            points = answer_key.for_quiz(session.quiz).grade(idx, sel_ints)
+            state.participant_pks.setdefault(request.user.id, lp.pk)
+            if live_state.queue_answer(state, request.user.id, idx, sel_ints, points):
                 messages.success(request, "Answer submitted.")
             return redirect("livesession_play", pk=session.pk)
 
     already_answered = False
     selected = set()
 
-    if lp:
-        answers = lp.answer_questions or []
-        for a in answers:
-            try:
-                if int(a.get("question_id", -999)) == idx:
-                    already_answered = True
-                    selected = {int(i) for i in (a.get("selected") or [])}
-                    break
-            except (TypeError, ValueError):
-                pass
+    # The in-memory answered set also covers answers still queued for the flusher
+    if lp and (request.user.id, idx) in state.answered:
+        already_answered = True
+        ans = LiveAnswer.objects.filter(participant=lp, question_index=idx).only("selected").first()
+        if ans:
+            selected = set(ans.selected or [])
 
     return render(
         request,
@@ -1493,9 +1388,7 @@ def livesession_play(request, pk: int):
 def livesession_join(request):
     if request.method == "POST":
         code = (request.POST.get("join_code") or "").strip().upper()
-        session = LiveSession.objects.filter(details__join_code=code).select_related(
-            "quiz", "quiz__course", "quiz__course__organization"
-        ).first()
+        session = LiveJoinCode.resolve(code)
         if not session:
             return render(request, "main_app/join.html", {"error": "Invalid join code."})
 
@@ -1505,19 +1398,19 @@ def livesession_join(request):
         if role != ROLE_SUPERUSER and org and org.id != session.quiz.course.organization_id:
             return render(request, "403.html", status=403)
 
-        if session.started_at and not session.ended_at:
-            LiveParticipant.objects.get_or_create(livesession=session, user=request.user)
+        state = live_state.get_state(session)
+        if state.started and not state.ended:
+            changes = roster.admit(state, request.user.id)
+            if changes:
+                live_state.touch(state)
+                _roster_send(state, changes)
             return redirect("livesession_play", pk=session.pk)
 
-        d = dict(session.details or {})
-        lobby = set(d.get("lobby", []))
-        lobby.add(request.user.id)
-        d["lobby"] = list(lobby)
-        session.details = d
-        session.save(update_fields=["details"])
-
-        # NEW: push lobby → all connected clients (host sees lobby update instantly)
-        _live_update_send(session.id, {"lobby_users": _lobby_users_rows_for_ws(session)})
+        changes = roster.join(state, request.user.id)
+        if changes:
+            live_state.touch(state)
+            # push the new lobby row → all connected clients (host sees it instantly)
+            _roster_send(state, changes)
 
         return render(request, "main_app/join.html", {"session": session, "waiting": True})
 
@@ -1534,16 +1427,47 @@ def livesession_status(request, pk: int):
     if role != ROLE_SUPERUSER and not allowed(request.user, READ_ONE, LIVE_SESSION, org=session.quiz.course.organization):
         return JsonResponse({"error": "forbidden"}, status=403)
 
-    idx, total = _get_idx_and_total(session)
+    state = live_state.get_state(session)
+    idx, total = state.idx_and_total()
     return JsonResponse(
         {
-            "started": bool(session.started_at),
-            "ended": bool(session.ended_at),
+            "started": state.started,
+            "ended": state.ended,
             "current_index": idx,
             "total": total,
         }
     )
 
+@login_required
+def livesession_leaderboard(request, pk: int):
+    """Host-only board as JSON: the live top k (?k=) while running, every row once ended."""
+    session = get_object_or_404(LiveSession, pk=pk)
+    if request.user.id != session.host_id:
+        return JsonResponse({"error": "forbidden"}, status=403)
+
+    state = live_state.get_state(session)
+    if state.ended:
+        rows = full_leaderboard_rows(session)
+        return JsonResponse({"ended": True, "rows": rows, "total": len(rows)})
+    return JsonResponse({"ended": False, **live_board(state.ranking, board_size(request.GET.get("k")))})
+
+
+def _can_review_answers(user, session: LiveSession) -> bool:
+    """
+    Who may see (and export) everyone's answers:
+    - Superuser/Admin/Manager with org-scoped read on the session
+    - Teacher, but only if they host the session
+    """
+    role, _org = _actor_role_and_org(user)
+    if role == ROLE_SUPERUSER:
+        return True
+    if not allowed(user, READ_ONE, LIVE_SESSION, org=session.quiz.course.organization):
+        return False
+    if role == ROLE_TEACHER:
+        return user.id == session.host_id
+    return role not in {ROLE_STUDENT, ROLE_PARENTS}
+
+
 @login_required
 def livesession_answers(request, pk: int):
     # Load session + permission gate
@@ -1553,102 +1477,133 @@ def livesession_answers(request, pk: int):
         ),
         pk=pk,
     )
-    role, _org = _actor_role_and_org(request.user)
-
-    # Must have org-scoped read on the session
-    if role != ROLE_SUPERUSER and not allowed(
-        request.user, READ_ONE, LIVE_SESSION, org=session.quiz.course.organization
-    ):
-        return render(request, "403.html", status=403)
-
-    # Who’s allowed to view detailed answers?
-    # - Superuser/Admin/Manager
-    # - Teacher, but only if they own this course (host)
-    if role == ROLE_TEACHER and request.user.id != session.host_id:
-        return render(request, "403.html", status=403)
-    if role in {ROLE_STUDENT, ROLE_PARENTS}:
+    if not _can_review_answers(request.user, session):
         return render(request, "403.html", status=403)
 
     if not session.ended_at:
         messages.info(request, "This session hasn’t ended yet.")
         return redirect("livesession_detail", pk=session.pk)
 
-    # Build per-question rows
-    questions = _quiz_questions(session)  # uses your existing helper
-    participants = list(
-        LiveParticipant.objects.select_related("user")
-        .filter(livesession=session)
-        .order_by("user__username")
-    )
-
-    per_question = []
-    for idx, q in enumerate(questions):
-        q_rows = []
-        for p in participants:
-            # find participant's answer for this question index
-            ans = None
-            for a in (p.answer_questions or []):
-                try:
-                    if int(a.get("question_id", -999)) == idx:
-                        ans = a
-                        break
-                except (TypeError, ValueError):
-                    pass
-
-            if ans:
-                selected = []
-                for raw in (ans.get("selected") or []):
-                    try:
-                        selected.append(int(raw))
-                    except Exception:
-                        continue
-                # Map selected indexes → choice text
-                choice_texts = []
-                for i in selected:
-                    chs = q.get("choices") or []
-                    if 0 <= i < len(chs):
-                        choice_texts.append(chs[i].get("text") or f"Choice {i+1}")
-                points = int(ans.get("points", 0))
-                q_rows.append(
-                    {
-                        "user": p.user,
-                        "selected_indexes": selected,
-                        "selected_texts": choice_texts,
-                        "points": points,
-                        "skipped": False,
-                    }
-                )
-            else:
-                q_rows.append(
-                    {
-                        "user": p.user,
-                        "selected_indexes": [],
-                        "selected_texts": [],
-                        "points": 0,
-                        "skipped": True,
-                    }
-                )
-
-        # stats
-        attempted = sum(1 for r in q_rows if not r["skipped"])
-        correct = sum(1 for r in q_rows if r["points"] > 0)
-        avg_points = round(sum(r["points"] for r in q_rows) / max(len(q_rows), 1), 2)
-
-        per_question.append(
-            {
-                "index": idx,
-                "question": q,
-                "rows": q_rows,
-                "stats": {"attempted": attempted, "correct": correct, "avg_points": avg_points},
-            }
-        )
+    # Built once per ended session (single pass), then served from cache / the stored report
+    report = reports.answers_report(session, _quiz_questions(session))
 
     return render(
         request,
         "main_app/livesession_answers.html",
         {
             "session": session,
-            "per_question": per_question,
+            "per_question": report["per_question"],
         },
     )
 
+
+@login_required
+def livesession_export(request, pk: int, fmt: str):
+    """Results (participant x question points and selections) as streamed CSV or XLSX."""
+    session = get_object_or_404(
+        LiveSession.objects.select_related("quiz", "quiz__course", "quiz__course__organization"), pk=pk
+    )
+    if fmt not in {"csv", "xlsx"}:
+        raise Http404("Unknown export format")
+    if not _can_review_answers(request.user, session):
+        return render(request, "403.html", status=403)
+    if not session.ended_at:
+        messages.info(request, "This session hasn’t ended yet.")
+        return redirect("livesession_detail", pk=session.pk)
+
+    ensure_final(session)  # its finalise job may not have run yet
+    batches = exports.result_batches(session, _quiz_questions(session))
+    filename = f"session-{session.pk}-results.{fmt}"
+    if fmt == "csv":
+        response = StreamingHttpResponse(
+            exports.streaming_content(request, exports.csv_chunks(batches)),
+            content_type=exports.CSV_CONTENT_TYPE,
+        )
+    else:
+        f, size = exports.xlsx_file(batches)
+        response = StreamingHttpResponse(
+            exports.streaming_content(request, exports.file_chunks(f)),
+            content_type=exports.XLSX_CONTENT_TYPE,
+        )
+        response["Content-Length"] = str(size)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+def livesession_export_job(request, pk: int, fmt: str):
+    """POST: queue the results export as a background job; poll the returned status_url."""
+    session = get_object_or_404(
+        LiveSession.objects.select_related("quiz", "quiz__course", "quiz__course__organization"), pk=pk
+    )
+    if fmt not in {"csv", "xlsx"}:
+        raise Http404("Unknown export format")
+    if request.method != "POST":
+        return JsonResponse({"error": "POST required"}, status=405)
+    if not _can_review_answers(request.user, session):
+        return JsonResponse({"error": "forbidden"}, status=403)
+    if not session.ended_at:
+        return JsonResponse({"error": "session has not ended"}, status=409)
+
+    job = jobs.enqueue("live.export", user=request.user, session_id=session.pk, fmt=fmt)
+    return JsonResponse(
+        {**jobs.status(job), "status_url": reverse("job_status", args=[job.pk])}, status=202
+    )
+
+
+def _own_job(request, pk: int) -> Job:
+    job = get_object_or_404(Job, pk=pk)
+    if not request.user.is_superuser and job.created_by_id != request.user.id:
+        raise Http404("No such job")  # don't reveal other users' jobs
+    return job
+
+
+@login_required
+def job_status(request, pk: int):
+    """Status and progress of one of the user's background jobs, for polling."""
+    job = _own_job(request, pk)
+    data = jobs.status(job)
+    if job.status == Job.DONE and (job.result or {}).get("file"):
+        data["download_url"] = reverse("job_download", args=[job.pk])
+    return JsonResponse(data)
+
+
+@login_required
+def job_download(request, pk: int):
+    """The file a finished job produced, e.g. a background export."""
+    job = _own_job(request, pk)
+    name = (job.result or {}).get("file")
+    if job.status != Job.DONE or not name or not jobs.files.exists(name):
+        raise Http404("No file for this job")
+    return FileResponse(jobs.files.open(name, "rb"), as_attachment=True, filename=job.result.get("filename"))
+
+
+@login_required
+def course_gradebook(request, pk: int, fmt: str):
+    """Students x ended sessions score matrix of a course, streamed as CSV or XLSX."""
+    course = get_object_or_404(Course.objects.select_related("organization"), pk=pk)
+    if fmt not in {"csv", "xlsx"}:
+        raise Http404("Unknown export format")
+    role, _org = _actor_role_and_org(request.user)
+    if role != ROLE_SUPERUSER and not allowed(request.user, READ_ONE, COURSE, org=course.organization):
+        return render(request, "403.html", status=403)
+    if role == ROLE_TEACHER and course.teacher_id != request.user.id:
+        return render(request, "403.html", status=403)
+    if role in {ROLE_STUDENT, ROLE_PARENTS}:
+        return render(request, "403.html", status=403)
+
+    batches = gradebook.batches(gradebook.matrix(course))
+    if fmt == "csv":
+        response = StreamingHttpResponse(
+            exports.streaming_content(request, exports.csv_chunks(batches)),
+            content_type=exports.CSV_CONTENT_TYPE,
+        )
+    else:
+        f, size = exports.xlsx_file(batches, sheet_name="Gradebook")
+        response = StreamingHttpResponse(
+            exports.streaming_content(request, exports.file_chunks(f)),
+            content_type=exports.XLSX_CONTENT_TYPE,
+        )
+        response["Content-Length"] = str(size)
+    response["Content-Disposition"] = f'attachment; filename="course-{course.pk}-gradebook.{fmt}"'
+    return response
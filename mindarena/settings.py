@@ -80,6 +80,7 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
                 "django.template.context_processors.static",
+                "main_app.context_processors.permissions",
             ],
         },
     },
@@ -189,3 +190,13 @@ LOGOUT_REDIRECT_URL = "/"
 # Misc
 # -----------------------------------------------------------------------------
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# main_app logs timings of heavy live-session work (e.g. leaderboard finalisation)
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "main_app": {"handlers": ["console"], "level": os.getenv("MAIN_APP_LOG_LEVEL", "INFO")},
+    },
+}